@@ -4,6 +4,10 @@ import base64
 import pandas as pd
 import numpy as np
 
+from build_cube import CUBE_PATH, SOURCES, build_source
+from data_store import dataset_version, load_dataset
+from fx_rates import RATES_PATH, load_rates, to_eur
+
 # https://discuss.streamlit.io/t/table-of-contents-widget/3470/12
 class Toc:
 
@@ -39,13 +43,13 @@ class Toc:
 
 # LOGO
 # https://discuss.streamlit.io/t/href-on-image/9693/4
-@st.cache(ttl=60*60*24*7, max_entries=300, allow_output_mutation=True)
+@st.cache_data(ttl=60*60*24*7, max_entries=300)
 def get_base64_of_bin_file(bin_file):
     with open(bin_file, 'rb') as f:
         data = f.read()
     return base64.b64encode(data).decode()
 
-@st.cache(ttl=60*60*24*7, max_entries=300, allow_output_mutation=True)
+@st.cache_data(ttl=60*60*24*7, max_entries=300)
 def get_img_with_href(local_img_path, target_url, max_width):
     img_format = os.path.splitext(local_img_path)[-1].replace('.', '')
     bin_str = get_base64_of_bin_file(local_img_path)
@@ -55,53 +59,157 @@ def get_img_with_href(local_img_path, target_url, max_width):
         </a>'''
     return html_code
 
-@st.cache(ttl=60*60*24*7, max_entries=300)
-def read_df(path:str):
-    return pd.read_csv(path)
-
-@st.cache(ttl=60*60*24*7, max_entries=300)
-def create_table(df, category_column:str, category_list:list, calculate_volume:bool, table_height:int):
-    category_returns = []
-    for cat in category_list:
-        df_cat = df[df[category_column]==cat]
-
-        dates = np.sort(df_cat["date"].unique())
-
-        prices = []
-        start_year = df_cat["date"].min()
-        if pd.isna(start_year):
-            continue
-        df_cat_date = df_cat[df_cat["date"]==start_year]
-        if calculate_volume: 
-            prices.append(df_cat_date["end_price"].sum())
-        else:
-            prices.append(df_cat_date["end_price"].mean())
-        price_changes = []
-        last_year = start_year
-        for date in dates[1:]:
-            df_cat_date = df_cat[df_cat["date"]==date]
-
-            start_sum = prices[-1]
-            end_sum = 0
-            if calculate_volume: 
-                end_sum = df_cat_date["end_price"].sum()
-            else:
-                end_sum = df_cat_date["end_price"].mean()
-
-            if start_sum == 0 or end_sum == 0:
-                continue
-            price_change = (end_sum - start_sum) / start_sum * 100 / (date-last_year)
-            price_changes.append(price_change) # Kasvu arvutus
-            prices.append(end_sum) # Jätame meelde selle aasta hinna
-            last_year = date
-        annual_return = round(np.mean(price_changes), 4)
-        total_return = round(annual_return * len(dates), 4)
-        if len(dates) == 1:
-            annual_return = 0
-            total_return = 0
-        year_span = " - ".join(map(str, [round(start_year), round(last_year)]))
-        category_returns.append([cat, year_span, total_return, annual_return])
-        
-    df_cat_returns = pd.DataFrame(category_returns, columns=["Kategooria", "Aastavahemik", "Kogukasv algusest (%)", "Iga-aastane kasv (%)"]) 
+# Cached results are keyed on the file version and the scalar arguments,
+# frames passed as _df or _cube are never hashed by Streamlit
+def read_df(path:str, columns:list=None):
+    return _read_df(path, columns, dataset_version(path))
+
+@st.cache_data(ttl=60*60*24*7, max_entries=300)
+def _read_df(path:str, columns:list, version:tuple):
+    return load_dataset(path, columns)
+
+def rates_version():
+    # Part of the cache key of frames converted by read_df_in_eur, None without a rate table
+    return dataset_version(RATES_PATH) if os.path.exists(RATES_PATH) else None
+
+def read_df_in_eur(path:str, columns:list, price_columns:list, year_column:str="auction_year"):
+    """Same as read_df, with the price columns converted to euros at the middle of each row's year
+
+    Without data/fx_rates.csv (see fx_rates.py) the prices stay in their own currencies."""
+    if rates_version() is None:
+        st.warning(f"{RATES_PATH} is missing, prices are not converted to euros.")
+        return read_df(path, columns)
+    return _read_df_in_eur(path, columns, price_columns, year_column, dataset_version(path), rates_version())
+
+@st.cache_data(ttl=60*60*24*7, max_entries=300)
+def _read_df_in_eur(path:str, columns:list, price_columns:list, year_column:str, version:tuple, rates_version:tuple):
+    df = to_eur(load_dataset(path, columns), price_columns, load_rates(), date_column=None, year_column=year_column)
+    # The pages average end_price, it now means the same across currencies
+    for column in price_columns:
+        df[column] = df.pop(f"{column}_eur")
+    return df
+
+def cube_version(source:str):
+    path = CUBE_PATH.format(source=source)
+    if not os.path.exists(path):
+        return dataset_version(SOURCES[source][0])
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def read_cube(source:str):
+    return _read_cube(source, cube_version(source))
+
+@st.cache_data(ttl=60*60*24*7, max_entries=300)
+def _read_cube(source:str, version:tuple):
+    # Built offline with build_cube.py, fall back to building it from the csv
+    path = CUBE_PATH.format(source=source)
+    if not os.path.exists(path):
+        return build_source(source)
+    return pd.read_parquet(path)
+
+def map_category_returns(keys, table_data):
+    # Annual return of each key from a create_table result as a float column, one hash join
+    returns = table_data.drop_duplicates("Kategooria").set_index("Kategooria")["Iga-aastane kasv (%)"]
+    return keys.map(returns).astype("float64")
+
+def aggregate_cube(cube, by:list):
+    grouped = cube.groupby(by, observed=True)[["count", "sum", "overbid_count", "overbid_sum"]].sum()
+    return pd.DataFrame({
+        "total_sales": grouped["sum"],
+        "avg_price": grouped["sum"] / grouped["count"],
+        "overbid_%": grouped["overbid_sum"] / grouped["overbid_count"],
+    }).reset_index()
+
+def cube_overbid_range(cube):
+    # Mean and standard deviation of overbid_% over all lots in the cube
+    count = cube["overbid_count"].sum()
+    total = cube["overbid_sum"].sum()
+    mean = total / count
+    std = np.sqrt((cube["overbid_sum_sq"].sum() - total * mean) / (count - 1))
+    return mean, std
+
+def _pivot_year_matrix(prices, lots, category_list):
+    prices = prices.unstack("date").sort_index(axis=1).reindex(index=category_list)
+    lots = lots.unstack("date").reindex(index=category_list, columns=prices.columns)
+    years = prices.columns.to_numpy(dtype="float64")
+    return years, prices.to_numpy(dtype="float64"), lots.fillna(0).to_numpy() > 0
+
+def _category_year_matrix(df, category_column:str, category_list, calculate_volume:bool):
+    # One groupby pass over the rows instead of masking the frame per category and per year
+    grouped = df["end_price"].astype("float64").groupby([df[category_column], df["date"]], observed=True)
+    prices = grouped.sum() if calculate_volume else grouped.mean()
+    return _pivot_year_matrix(prices, grouped.size(), category_list)
+
+def _cube_year_matrix(cube, category_column:str, category_list, calculate_volume:bool):
+    grouped = cube.groupby([category_column, "date"], observed=True)[["lots", "count", "sum"]].sum()
+    prices = grouped["sum"] if calculate_volume else grouped["sum"] / grouped["count"]
+    return _pivot_year_matrix(prices, grouped["lots"], category_list)
+
+def create_table(df, category_column:str, category_list:list, calculate_volume:bool, table_height:int, version):
+    # version identifies the frame's content, ex. dataset_version of the file it was read from
+    return _create_table(df, version, category_column, list(category_list), calculate_volume)
+
+@st.cache_data(ttl=60*60*24*7, max_entries=300)
+def _create_table(_df, version, category_column:str, category_list:list, calculate_volume:bool):
+    categories = np.asarray(category_list, dtype=object)
+    if _df.empty or len(categories) == 0:
+        return _returns_table(categories, None)
+    return _returns_table(categories, _category_year_matrix(_df, category_column, categories, calculate_volume))
+
+def create_cube_table(cube, category_column:str, category_list:list, calculate_volume:bool, table_height:int, version):
+    """Same table as create_table, computed from the aggregate cube instead of raw rows"""
+    return _create_cube_table(cube, version, category_column, list(category_list), calculate_volume)
+
+@st.cache_data(ttl=60*60*24*7, max_entries=300)
+def _create_cube_table(_cube, version, category_column:str, category_list:list, calculate_volume:bool):
+    categories = np.asarray(category_list, dtype=object)
+    if _cube.empty or len(categories) == 0:
+        return _returns_table(categories, None)
+    return _returns_table(categories, _cube_year_matrix(_cube, category_column, categories, calculate_volume))
+
+def _returns_table(categories, matrix):
+    columns = ["Kategooria", "Aastavahemik", "Kogukasv algusest (%)", "Iga-aastane kasv (%)"]
+    if matrix is None or not matrix[2].any():
+        return pd.DataFrame([], columns=columns).drop("Kogukasv algusest (%)", axis=1)
+
+    years, prices, present = matrix
+    rows = np.arange(len(categories))
+    n_dates = present.sum(axis=1)
+    has_data = n_dates > 0
+
+    # The first auction year is the base price. Years with a zero price are skipped,
+    # and a zero base price means no following year can be compared against it.
+    first = present.argmax(axis=1)
+    valid = present & (prices != 0)
+    valid[prices[rows, first] == 0] = False
+    valid[rows, first] = has_data
+    last = valid.shape[1] - 1 - valid[:, ::-1].argmax(axis=1)
+
+    # Kasvu arvutus between each pair of consecutive valid years of the same category
+    valid_rows, valid_cols = np.nonzero(valid)
+    same = valid_rows[1:] == valid_rows[:-1]
+    change_rows = valid_rows[1:][same]
+    start_cols, end_cols = valid_cols[:-1][same], valid_cols[1:][same]
+    start_sum, end_sum = prices[change_rows, start_cols], prices[change_rows, end_cols]
+    price_changes = (end_sum - start_sum) / start_sum * 100 / (years[end_cols] - years[start_cols])
+
+    change_sums = np.zeros(len(categories))
+    if len(price_changes):
+        offsets = np.flatnonzero(np.r_[True, change_rows[1:] != change_rows[:-1]])
+        change_sums[change_rows[offsets]] = np.add.reduceat(price_changes, offsets)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        annual_return = np.round(change_sums / np.bincount(change_rows, minlength=len(categories)), 4)
+    total_return = np.round(annual_return * n_dates, 4)
+    annual_return[n_dates == 1] = 0
+    total_return[n_dates == 1] = 0
+
+    start_year = np.round(years[first[has_data]]).astype(int)
+    last_year = np.round(years[last[has_data]]).astype(int)
+    df_cat_returns = pd.DataFrame({
+        columns[0]: categories[has_data],
+        columns[1]: [f"{start} - {end}" for start, end in zip(start_year, last_year)],
+        columns[2]: total_return[has_data],
+        columns[3]: annual_return[has_data],
+    })
     df_cat_returns = df_cat_returns.sort_values(by="Iga-aastane kasv (%)", ascending=False)
     return df_cat_returns.drop("Kogukasv algusest (%)", axis=1)
\ No newline at end of file
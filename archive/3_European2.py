@@ -1,7 +1,8 @@
 import streamlit as st
 import plotly.express as px
 import pandas as pd
-from StreamlitHelper import Toc, get_img_with_href, read_df, create_table
+from StreamlitHelper import Toc, get_img_with_href, read_df, read_df_in_eur, rates_version, create_table, map_category_returns
+from data_store import dataset_version
 
 st.set_page_config(
     page_title="Art Index",
@@ -37,9 +38,11 @@ def create_paragraph(text):
 toc = Toc()
 toc.placeholder(sidebar=True)
 
-df = pd.read_csv('data/europe2.csv')
+# Prices of the SEK, EUR and USD auctions in euros, so the averages compare
+df = read_df_in_eur('data/europe2.csv', columns=["auction_year", "author", "technique", "end_price", "start_price", "dimension", "currency"], price_columns=["end_price", "start_price"])
+# Cache key of the tables built from df
+df_key = (dataset_version('data/europe2.csv'), rates_version())
 df = df[df["auction_year"] >= 2002]
-df = df.drop("Unnamed: 0", axis=1)
 df = df[df["dimension"]>0]
 df = df.dropna(subset=["currency"])
 df['date'] = df["auction_year"]
@@ -91,7 +94,7 @@ create_paragraph('Tekst')
 # TABLE - categories average price
 toc.subheader('Tabel - Ajalooline hinnanäitaja kategooriate kaupa')
 df["category"] = df["technique"]
-table_data = create_table(df, category_column="category", category_list=top_10_categories, calculate_volume=False, table_height=150)
+table_data = create_table(df, category_column="category", category_list=top_10_categories, calculate_volume=False, table_height=150, version=df_key)
 st.table(table_data)
 create_paragraph('Meediumite ehk tehnika järgi järjestud vastavalt sellele, missugused meediumid domineerivad kõige kallimalt müüdud teoste hulgas.')
 
@@ -109,7 +112,7 @@ create_paragraph('''Tekst
 
 # TABLE - categories volume
 toc.subheader('Tabel - Ajalooline volüümi kasv kategooriate kaupa')
-table_data = create_table(df, category_column="category", category_list=top_10_categories, calculate_volume=True, table_height=150)
+table_data = create_table(df, category_column="category", category_list=top_10_categories, calculate_volume=True, table_height=150, version=df_key)
 st.table(table_data)
 create_paragraph('Sellest tabelist näeme, milline meedium on olnud kõige suurema käibega. Antud andmete põhjal võime näiteks näha, et graafika on kõige populaarsem ning kõige suurema käibe tõusu protsendiga.(Keskmiselt 204% 20 aasta jooksul ja õlimaalil samal ajal 35%)')
 
@@ -120,7 +123,7 @@ df['start_price'] = df['start_price'].fillna(df['end_price'])
 df['overbid_%'] = (df['end_price'] - df['start_price'])/df['start_price'] * 100
 #df['art_work_age'] = df['date'] - df['year']
 df2 = df[df["technique"].isin(top_10_categories)]
-df2 = df2.groupby(['author', 'technique']).agg({'end_price':['sum'], 'overbid_%':['mean']})
+df2 = df2.groupby(['author', 'technique'], observed=True).agg({'end_price':['sum'], 'overbid_%':['mean']})
 df2.columns = ['total_sales', 'overbid_%']
 df2 = df2.dropna(subset="overbid_%")
 df2 = df2[df2["total_sales"] > 0]
@@ -133,18 +136,19 @@ for cat in top_10_categories:
     top_10_cat_indexes.extend(list(indexes))
 df2 = df2[df2.index.isin(top_10_cat_indexes)]
 
-@st.cache(ttl=60*60*24*7, max_entries=300, allow_output_mutation=True)
-def create_treemap():
-    return px.treemap(df2, path=[px.Constant("Techniques"), 'technique', 'author'], values='total_sales',
+# df2 follows from df, so the version of df is its key too
+@st.cache_data(ttl=60*60*24*7, max_entries=300)
+def create_treemap(_df2, _df, version):
+    return px.treemap(_df2, path=[px.Constant("Techniques"), 'technique', 'author'], values='total_sales',
                       color='overbid_%',
                       color_continuous_scale='RdBu',
-                      range_color = (0, df['overbid_%'].mean() + df['overbid_%'].std()),
+                      range_color = (0, _df['overbid_%'].mean() + _df['overbid_%'].std()),
                       labels={
                          "overbid_%": "Ülepakkumine (%)",
                          "total_sales": "Kogumüük",
                          "author": "Autor",
                       })
-fig = create_treemap()
+fig = create_treemap(df2, df, df_key)
 fig.update_layout(margin=dict(l=5, r=5, t=5, b=5))
 fig.update_traces(hovertemplate='<b>%{label} </b> <br> Kogumüük: %{value}<br> Ülepakkumine (%): %{color:.2f}',)
 st.plotly_chart(fig, use_container_width=True)
@@ -152,7 +156,7 @@ create_paragraph('''Tekst
 ''')
 
 # TABLE - best authors average price
-author_sum = df.groupby(["author"], sort=False)["end_price"].sum()
+author_sum = df.groupby(["author"], sort=False, observed=True)["end_price"].sum()
 top_authors = []
 for author in author_sum.sort_values(ascending=False).index:
     if df[df["author"] == author]["date"].nunique() > 1:
@@ -161,7 +165,7 @@ for author in author_sum.sort_values(ascending=False).index:
             break
 
 toc.subheader('Tabel - Top 10 parimat kunstnikku')
-table_data = create_table(df, category_column="author", category_list=top_authors, calculate_volume=False, table_height=250)    
+table_data = create_table(df, category_column="author", category_list=top_authors, calculate_volume=False, table_height=250, version=df_key)    
 st.table(table_data)
 create_paragraph('''Tekst
 ''')
@@ -171,10 +175,10 @@ toc.subheader('Joonis - Kunsti müügid kategooria ja kunstniku järgi')
 
 df2 = df[df["technique"].isin(top_10_categories)]
 df2 = df2[df["author"].isin(top_authors)]
-table_data = create_table(df2, category_column="author", category_list=top_authors, calculate_volume=False, table_height=250)
-df2["yearly_performance"] = [table_data[table_data["Kategooria"] == x]["Iga-aastane kasv (%)"] for x in df2["author"]]
+table_data = create_table(df2, category_column="author", category_list=top_authors, calculate_volume=False, table_height=250, version=(df_key, "top_categories"))
+df2["yearly_performance"] = map_category_returns(df2["author"], table_data)
 
-df2 = df2.groupby(['author', 'technique']).agg({'end_price':['sum'], 'yearly_performance':['mean']})
+df2 = df2.groupby(['author', 'technique'], observed=True).agg({'end_price':['sum'], 'yearly_performance':['mean']})
 df2.columns = ['total_sales', 'yearly_performance']
 df2 = df2.reset_index()
 
@@ -195,7 +199,7 @@ create_paragraph('''...
 
 # TABLE - best authors volume
 toc.subheader('Tabel - Volüümi kasv Top 10 kunstnikul')
-table_data = create_table(df, category_column="author", category_list=top_authors, calculate_volume=True, table_height=250)    
+table_data = create_table(df, category_column="author", category_list=top_authors, calculate_volume=True, table_height=250, version=df_key)    
 st.table(table_data)
 create_paragraph('''Tekst
 ''')
@@ -229,10 +233,10 @@ create_credits('''Allikad: Eesti avalikud kunsti oksjonid (2001-2021)''')
 create_credits('''Muu: Inspireeritud Riivo Antoni loodud kunstiindeksist; <br>Heldet toetust pakkus <a href="https://tezos.foundation/">Tezos Foundation</a>''')
 toc.generate()
 
-@st.cache
-def convert_df():
+@st.cache_data
+def convert_df(version):
     # IMPORTANT: Cache the conversion to prevent computation on every rerun
     return read_df('data/europe2.csv').to_csv().encode('utf-8')
 
-csv = convert_df()
+csv = convert_df(dataset_version('data/europe2.csv'))
 st.download_button(label="Laadi alla andmed",data=csv, file_name='europe_art_index.csv', mime='text/csv')
\ No newline at end of file
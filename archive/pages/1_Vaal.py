@@ -2,6 +2,7 @@ import streamlit as st
 import plotly.express as px
 import pandas as pd
 import numpy as np
+from StreamlitHelper import read_df
 
 st.title('Kanvas.AI Art Index')
 
@@ -9,10 +10,10 @@ st.header('Vaal Auctions - Map of Art Market')
 
 st.subheader('Total sales by artist and overbidding amount')
 
-df = pd.read_csv('data/vaal_clean.csv')
+df = read_df('data/vaal_clean.csv', columns=["date", "year", "decade", "author", "technique", "category", "end_price", "start_price"])
 df['overbid_%'] = (df['end_price'] - df['start_price'])/df['start_price'] * 100
 df['art_work_age'] = df['date'] - df['year']
-df2 = df.groupby(['author', 'technique', 'category']).agg({'end_price':['sum'], 'overbid_%':['mean']})
+df2 = df.groupby(['author', 'technique', 'category'], observed=True).agg({'end_price':['sum'], 'overbid_%':['mean']})
 df2.columns = ['total_sales', 'overbid_%']
 df2 = df2.reset_index()
 
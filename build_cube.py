@@ -0,0 +1,84 @@
+"""Offline build step for the aggregate cube read by the index pages.
+
+The cube holds one row per (date, category, technique, author) of a source with
+the lot count, end price sum, sum of squares, min, max and overbid sums, so the
+pages can build their tables and treemaps without grouping the raw rows.
+
+Rebuild after the cleaned csv files in data/ change:
+
+$ python build_cube.py [auctions] [haus]
+"""
+import sys
+
+import numpy as np
+
+from data_store import load_dataset, replace_value
+
+CUBE_KEYS = ["date", "category", "technique", "author"]
+CUBE_PATH = "data/{source}_cube.parquet"
+
+
+def prepare_auctions(df):
+    # Estonian auctions as shown on the English and Estonian index pages
+    df = df[df["date"] >= 2001]
+    df = df[df["date"] <= 2021].copy()
+    df["date"] = df["date"].astype("int")
+    df = df.sort_values(by=["date"])
+    replace_value(df, "technique", "Mixed tech", "Mixed technique")
+    return df
+
+
+def prepare_haus(df):
+    # Haus Galerii auctions as shown on the Haus index page
+    df = df[df["date"] >= 2001]
+    df = df[df["date"] <= 2023]
+    df = df.sort_values(by=["date"])
+    return df.dropna(subset=["author"])
+
+
+SOURCES = {
+    "auctions": ("data/auctions_clean.csv", prepare_auctions),
+    "haus": ("data/haus_cleaned.csv", prepare_haus),
+}
+
+
+def build_cube(df):
+    # Sum in float64 even when the prices are stored as float32
+    end_price = df["end_price"].astype("float64")
+    start_price = df["start_price"].astype("float64").fillna(end_price)
+    overbid = (end_price - start_price) / start_price * 100
+    df = df[CUBE_KEYS].assign(
+        end_price=end_price,
+        end_price_sq=end_price ** 2,
+        overbid=overbid,
+        overbid_sq=overbid ** 2,
+    )
+    cube = df.groupby(CUBE_KEYS, dropna=False, observed=True).agg(
+        lots=("end_price", "size"),
+        count=("end_price", "count"),
+        sum=("end_price", "sum"),
+        sum_sq=("end_price_sq", "sum"),
+        min=("end_price", "min"),
+        max=("end_price", "max"),
+        overbid_count=("overbid", "count"),
+        overbid_sum=("overbid", "sum"),
+        overbid_sum_sq=("overbid_sq", "sum"),
+    ).reset_index()
+    return cube.astype({
+        "date": np.int16,
+        "lots": np.int32,
+        "count": np.int32,
+        "overbid_count": np.int32,
+    })
+
+
+def build_source(source:str):
+    path, prepare = SOURCES[source]
+    return build_cube(prepare(load_dataset(path, columns=CUBE_KEYS + ["start_price", "end_price"])))
+
+
+if __name__ == "__main__":
+    for source in sys.argv[1:] or list(SOURCES):
+        cube = build_source(source)
+        cube.to_parquet(CUBE_PATH.format(source=source), index=False)
+        print(f"Saved {len(cube)} cells of {source!r} to {CUBE_PATH.format(source=source)}")
@@ -0,0 +1,70 @@
+"""Columnar copies of the csv datasets in data/.
+
+Each data/<name>.csv is converted to data/<name>.parquet with compact dtypes:
+categorical author/technique/category, int16 years and float32 prices. The pages
+read the Parquet copy memory-mapped and only the columns they use.
+
+Convert again after a csv file changes:
+
+$ python data_store.py [data/auctions_clean.csv ...]
+"""
+import glob
+import os
+import sys
+
+import pandas as pd
+
+CATEGORY_COLUMNS = ["author", "technique", "tech", "category"]
+YEAR_COLUMNS = ["date", "year", "decade", "auction_year"]
+PRICE_COLUMNS = ["start_price", "end_price"]
+
+
+def parquet_path(path:str) -> str:
+    return os.path.splitext(path)[0] + ".parquet"
+
+
+def compact_dtypes(df):
+    df = df.copy()
+    for column in df.columns:
+        if column in CATEGORY_COLUMNS:
+            df[column] = df[column].astype("category")
+        elif column in YEAR_COLUMNS and pd.api.types.is_numeric_dtype(df[column]):
+            # int16 has no missing value, years with gaps stay float
+            df[column] = df[column].astype("int16" if df[column].notna().all() else "float32")
+        elif column in PRICE_COLUMNS and pd.api.types.is_numeric_dtype(df[column]):
+            df[column] = df[column].astype("float32")
+    return df
+
+
+def dataset_version(path:str) -> tuple:
+    # mtime and size of the file load_dataset reads, cheap enough to check on every rerun
+    parquet = parquet_path(path)
+    stat = os.stat(parquet if os.path.exists(parquet) else path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def load_dataset(path:str, columns:list=None):
+    """Read only the given columns of a dataset, from its Parquet copy if it was converted"""
+    parquet = parquet_path(path)
+    if os.path.exists(parquet):
+        return pd.read_parquet(parquet, columns=columns, memory_map=True)
+    return compact_dtypes(pd.read_csv(path, usecols=columns))
+
+
+def replace_value(df, column:str, change_from, change_to):
+    # A categorical column only accepts values that are already among its categories
+    if isinstance(df[column].dtype, pd.CategoricalDtype) and change_to not in df[column].cat.categories:
+        df[column] = df[column].cat.add_categories([change_to])
+    df.loc[df[column]==change_from, column] = change_to
+
+
+def convert(path:str):
+    df = compact_dtypes(pd.read_csv(path))
+    df.to_parquet(parquet_path(path), index=False)
+    return df
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:] or sorted(glob.glob("data/*.csv")):
+        df = convert(path)
+        print(f"Saved {len(df)} rows of {path} to {parquet_path(path)}")
@@ -0,0 +1,123 @@
+"""Historical exchange rates for converting auction prices to euros.
+
+The rates live in data/fx_rates.csv, one row per (date, currency) with the units
+of the currency one euro bought that day, the way the ECB quotes them. A row can
+as well stand for a whole year, dated on its first day. Build the table from the
+ECB reference rate history (eurofxref-hist.csv in
+https://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist.zip), then add yearly
+rows by hand for currencies or years it does not cover:
+
+$ python fx_rates.py eurofxref-hist.csv
+
+Prices are converted with the last rate on or before the auction date, an as-of
+join over all rows at once. Auctions older than the first rate of their currency
+use that first rate. The currencies replaced by the euro convert at their fixed
+rates at any date.
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+RATES_PATH = "data/fx_rates.csv"
+
+# Currencies some sources write as a symbol
+CURRENCY_SYMBOLS = {"€": "EUR", "$": "USD", "£": "GBP", "¥": "JPY"}
+
+# Irrevocable conversion rates of the currencies replaced by the euro
+EURO_FIXED_RATES = {
+    "ATS": 13.7603,
+    "BEF": 40.3399,
+    "DEM": 1.95583,
+    "EEK": 15.6466,
+    "ESP": 166.386,
+    "FIM": 5.94573,
+    "FRF": 6.55957,
+    "IEP": 0.787564,
+    "ITL": 1936.27,
+    "LTL": 3.4528,
+    "LVL": 0.702804,
+    "NLG": 2.20371,
+    "PTE": 200.482,
+}
+
+
+def load_rates(path:str=RATES_PATH):
+    """Read the rate table, sorted for the as-of join
+
+    :return: DataFrame with date, currency and per_eur columns"""
+    rates = pd.read_csv(path, parse_dates=["date"], dtype={"currency": "string", "per_eur": "float64"})
+    return rates.dropna().sort_values("date", kind="stable").reset_index(drop=True)
+
+
+def import_ecb(path:str):
+    # The ECB file has a column per currency, N/A before a currency was quoted and a trailing empty column
+    wide = pd.read_csv(path, na_values=["N/A"]).dropna(axis=1, how="all")
+    rates = wide.melt(id_vars="Date", var_name="currency", value_name="per_eur").dropna()
+    rates = rates.rename(columns={"Date": "date"})
+    rates["date"] = pd.to_datetime(rates["date"])
+    return rates.sort_values(["date", "currency"])[["date", "currency", "per_eur"]]
+
+
+def rates_per_eur(dates, currencies, rates):
+    """Look up the rate of every row with one as-of join
+
+    :param dates: Series of datetimes, NaT for unknown dates
+    :param currencies: Series of ISO currency codes
+    :param rates: DataFrame from load_rates
+    :return: ndarray Units of the currency per euro, NaN when there is no rate"""
+    # Join on integer codes of the few distinct currencies instead of millions of strings
+    codes, uniques = pd.factorize(np.asarray(currencies, dtype=object))
+    rates = rates.assign(code=pd.Index(uniques).get_indexer(rates["currency"].to_numpy(dtype=object)))
+    rates = rates[rates["code"] >= 0][["date", "code", "per_eur"]]
+    # merge_asof needs the same resolution on both sides, pandas infers it per source
+    rates = rates.assign(date=rates["date"].astype("datetime64[ns]"))
+
+    dates = pd.to_datetime(dates).to_numpy().astype("datetime64[ns]")
+    known = (codes >= 0) & ~np.isnat(dates)
+    keys = pd.DataFrame({"date": dates[known], "code": codes[known], "row": np.flatnonzero(known)})
+    keys = keys.sort_values("date", kind="stable")
+
+    per_eur = np.full(len(codes), np.nan)
+    # Backward finds the last rate on or before the date, forward covers dates before the first rate
+    for direction in ["backward", "forward"]:
+        missing = keys[np.isnan(per_eur[keys["row"].to_numpy()])]
+        if missing.empty or rates.empty:
+            break
+        matched = pd.merge_asof(missing, rates, on="date", by="code", direction=direction)
+        found = matched.dropna(subset=["per_eur"])
+        per_eur[found["row"].to_numpy()] = found["per_eur"].to_numpy()
+
+    fixed = np.array([1.0 if code == "EUR" else EURO_FIXED_RATES.get(code, np.nan) for code in uniques] + [np.nan])
+    # Code -1, a missing currency, picks the trailing NaN
+    fixed = fixed[codes]
+    return np.where(np.isnan(fixed), per_eur, fixed)
+
+
+def to_eur(df, columns:list, rates, date_column:str="auction_date", currency_column:str="currency", year_column:str="year"):
+    """Add a <column>_eur copy of every price column, converted at the rate of the auction date
+
+    Rows without a date, or every row when date_column is None, are converted at the middle of their year."""
+    dates = pd.to_datetime(df[date_column]) if date_column else pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    undated = dates.isna() & df[year_column].notna()
+    if undated.any():
+        years = df.loc[undated, year_column].astype("int64").astype(str)
+        dates = dates.copy()
+        dates[undated] = pd.to_datetime(years + "-07-01", errors="coerce")
+    currencies = df[currency_column].astype(object)
+    per_eur = rates_per_eur(dates, currencies.map(CURRENCY_SYMBOLS).fillna(currencies), rates)
+    df = df.copy()
+    for column in columns:
+        df[f"{column}_eur"] = df[column].to_numpy(dtype="float64") / per_eur
+    return df
+
+
+if __name__ == "__main__":
+    rates = import_ecb(sys.argv[1])
+    if os.path.exists(RATES_PATH):
+        # Keep the hand-made rows of dates and currencies the ECB file does not have
+        rates = pd.concat([load_rates(), rates]).drop_duplicates(["date", "currency"], keep="last")
+    rates = rates.sort_values(["date", "currency"])
+    rates.to_csv(RATES_PATH, index=False, date_format="%Y-%m-%d")
+    print(f"Saved {len(rates)} rates of {rates['currency'].nunique()} currencies to {RATES_PATH}")
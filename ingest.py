@@ -0,0 +1,314 @@
+"""Incremental ingestion of the scraper databases into one auction dataset.
+
+Rows of bidtoart (Art), findartinfo (Item) and Bukowskis (03_convert_to_csv output)
+are normalized to a single typed table: numeric prices, ISO currency codes, dates,
+and sizes in centimeters. Prices are also converted to euros with the rate
+table of fx_rates.py, so averages compare across sources. The table is written as
+Parquet partitioned by source and year, data/auctions/source=<source>/year=<year>/part-*.parquet.
+
+Every run only reads what changed since the watermark of the previous run,
+kept in data/auctions/_watermarks.json:
+
+- bidtoart, findartinfo: finished rows by their updated_at
+- bukowskis: rows with a lot_id above the last ingested one, up to the stage 3 checkpoint
+
+A run adds new part files and never rewrites the old ones. A lot ingested again
+after a change is in two parts, load_auctions keeps its latest version.
+
+$ python ingest.py [bidtoart] [findartinfo] [bukowskis]
+"""
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from fx_rates import CURRENCY_SYMBOLS, RATES_PATH, load_rates, to_eur
+from scrapers.common.dimensions import parse_dimensions
+
+SCRAPERS_DIR = "scrapers"
+DATASET_DIR = "data/auctions"
+WATERMARKS_FILE = os.path.join(DATASET_DIR, "_watermarks.json")
+CHUNK_SIZE = 50000
+# Rows stamped in the last seconds are left to the next run, a transaction that
+# is still committing can stamp an earlier updated_at than rows already visible
+SETTLE_SECONDS = 60
+
+SCHEMA = pa.schema([
+    ("source", pa.string()),
+    ("source_id", pa.int64()),
+    ("auction_date", pa.date32()),
+    ("year", pa.int16()),
+    ("author", pa.string()),
+    ("title", pa.string()),
+    ("technique", pa.string()),
+    ("category", pa.string()),
+    ("house", pa.string()),
+    ("dimensions", pa.string()),
+    ("width_cm", pa.float64()),
+    ("height_cm", pa.float64()),
+    ("area_cm2", pa.float64()),
+    ("start_price", pa.float64()),
+    ("end_price", pa.float64()),
+    ("currency", pa.string()),
+    ("start_price_eur", pa.float64()),
+    ("end_price_eur", pa.float64()),
+    ("updated_at", pa.timestamp("us")),
+])
+PARTITIONING = ds.partitioning(pa.schema([("source", pa.string()), ("year", pa.int16())]), flavor="hive")
+
+BIDTOART_QUERY = """
+    SELECT id, auction_date, auction_year, artist, title, technology, category, source, dimensions,
+           start_price, end_price, currency, updated_at
+    FROM lots_art
+    WHERE has_info_downloaded AND is_scraped AND updated_at > ? AND updated_at <= ?
+"""
+FINDARTINFO_QUERY = """
+    SELECT id, auction_date, auction_year, author, title, technique, dimensions,
+           start_price, end_price, currency, updated_at
+    FROM lots_item
+    WHERE prettified AND updated_at > ? AND updated_at <= ?
+"""
+
+
+def to_number(column):
+    # Keeps digits and the decimal point, ex. "1,200" or "12 000"
+    text = column.astype("string").str.replace(r"[^\d.]", "", regex=True)
+    return pd.to_numeric(text, errors="coerce").astype("float64")
+
+
+def to_year(date, fallback):
+    return date.dt.year.fillna(to_number(fallback)).astype("Int16")
+
+
+def sizes(dimensions, default_unit:str):
+    # Every side converted to cm on its own, see scrapers/common/dimensions.py
+    parsed = parse_dimensions(dimensions, default_unit)
+    return {"width_cm": parsed["width_cm"], "height_cm": parsed["height_cm"], "area_cm2": parsed["area_cm2"]}
+
+
+def db_chunks(source:str, query:str, params:tuple):
+    path = os.path.join(SCRAPERS_DIR, source, "db.sqlite3")
+    if not os.path.exists(path):
+        return
+    # Read only, the scrapers may be writing at the same time
+    with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as connection:
+        yield from pd.read_sql_query(query, connection, params=params, chunksize=CHUNK_SIZE)
+
+
+def db_cutoff() -> str:
+    # Same text format Django stores UTC datetimes in, so the values compare as strings
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=SETTLE_SECONDS)
+    return cutoff.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def normalize_bidtoart(df):
+    # ex. "Dec 12, 2019"
+    date = pd.to_datetime(df["auction_date"], format="mixed", errors="coerce")
+    return pd.DataFrame({
+        "source": "bidtoart",
+        "source_id": df["id"],
+        "auction_date": date.dt.normalize(),
+        "year": to_year(date, df["auction_year"]),
+        "author": df["artist"],
+        "title": df["title"],
+        "technique": df["technology"],
+        "category": df["category"],
+        "house": df["source"],
+        "dimensions": df["dimensions"],
+        # ex. "1.4 cm - 93.8 cm (0.55 in - 36.93 in)"
+        **sizes(df["dimensions"], "cm"),
+        "start_price": to_number(df["start_price"]),
+        "end_price": to_number(df["end_price"]),
+        "currency": df["currency"].map(CURRENCY_SYMBOLS).fillna(df["currency"]),
+        "updated_at": pd.to_datetime(df["updated_at"], format="ISO8601"),
+    })
+
+
+def normalize_findartinfo(df):
+    # ex. "12-Mar-2015"
+    date = pd.to_datetime(df["auction_date"], format="%d-%b-%Y", errors="coerce")
+    return pd.DataFrame({
+        "source": "findartinfo",
+        "source_id": df["id"],
+        "auction_date": date,
+        "year": to_year(date, df["auction_year"]),
+        "author": df["author"],
+        "title": df["title"],
+        "technique": df["technique"],
+        "category": None,
+        "house": None,
+        "dimensions": df["dimensions"],
+        # ex. "7.28 x 4.72 in"
+        **sizes(df["dimensions"], "in"),
+        "start_price": to_number(df["start_price"]),
+        "end_price": to_number(df["end_price"]),
+        "currency": df["currency"],
+        "updated_at": pd.to_datetime(df["updated_at"], format="ISO8601"),
+    })
+
+
+def normalize_bukowskis(df):
+    # ex. "2019-05-20T14:00:00+02:00"
+    date = pd.to_datetime(df["auction_date"], utc=True, errors="coerce").dt.tz_localize(None)
+    return pd.DataFrame({
+        "source": "bukowskis",
+        "source_id": df["lot_id"].astype("int64"),
+        "auction_date": date.dt.normalize(),
+        "year": date.dt.year.astype("Int16"),
+        "author": df["author"],
+        "title": None,
+        "technique": None,
+        "category": df["category"],
+        "house": "Bukowskis",
+        "dimensions": None,
+        "width_cm": float("nan"),
+        "height_cm": float("nan"),
+        "area_cm2": float("nan"),
+        "start_price": to_number(df["start_price"]),
+        "end_price": to_number(df["end_price"]),
+        "currency": df["currency"],
+        "updated_at": pd.Timestamp.now(tz="UTC").tz_localize(None),
+    })
+
+
+def read_bidtoart(watermark):
+    cutoff = db_cutoff()
+    chunks = db_chunks("bidtoart", BIDTOART_QUERY, (watermark or "", cutoff))
+    return (normalize_bidtoart(chunk) for chunk in chunks), cutoff
+
+
+def read_findartinfo(watermark):
+    cutoff = db_cutoff()
+    chunks = db_chunks("findartinfo", FINDARTINFO_QUERY, (watermark or "", cutoff))
+    return (normalize_findartinfo(chunk) for chunk in chunks), cutoff
+
+
+def read_bukowskis(watermark):
+    """Read the stage 3 rows converted since the last run
+
+    Rows past the stage 3 checkpoint can still be truncated by a resumed run,
+    so only the checkpointed ones are read."""
+    directory = os.path.join(SCRAPERS_DIR, "bukowskis")
+    for name in ["data_parquet", "data.csv"]:
+        path = os.path.join(directory, name)
+        if os.path.exists(f"{path}.checkpoint") and os.path.exists(path):
+            break
+    else:
+        return iter([]), watermark
+
+    with open(f"{path}.checkpoint") as f:
+        last = int(f.read().split()[0])
+    first = watermark or 0
+
+    if name == "data_parquet":
+        dataset = ds.dataset(path, format="parquet")
+        if "lot_id" not in dataset.schema.names:
+            print(f"{path} has no lot_id column, convert it again with 03_convert_to_csv.py --parquet --restart")
+            return iter([]), watermark
+        selected = (ds.field("lot_id") > first) & (ds.field("lot_id") <= last)
+        batches = dataset.to_batches(filter=selected, batch_size=CHUNK_SIZE)
+        chunks = (batch.to_pandas() for batch in batches)
+    else:
+        if "lot_id" not in pd.read_csv(path, nrows=0).columns:
+            print(f"{path} has no lot_id column, convert it again with 03_convert_to_csv.py --restart")
+            return iter([]), watermark
+        chunks = (
+            chunk[(chunk["lot_id"] > first) & (chunk["lot_id"] <= last)]
+            for chunk in pd.read_csv(path, chunksize=CHUNK_SIZE, dtype={"lot_id": "int64"}, keep_default_na=False)
+        )
+    return (normalize_bukowskis(chunk) for chunk in chunks if len(chunk)), last
+
+
+SOURCES = {
+    "bidtoart": read_bidtoart,
+    "findartinfo": read_findartinfo,
+    "bukowskis": read_bukowskis,
+}
+
+
+def read_watermarks() -> dict:
+    if not os.path.exists(WATERMARKS_FILE):
+        return {}
+    with open(WATERMARKS_FILE) as f:
+        return json.load(f)
+
+
+def write_watermarks(watermarks:dict):
+    with open(f"{WATERMARKS_FILE}.tmp", "w") as f:
+        json.dump(watermarks, f, indent=2)
+    os.replace(f"{WATERMARKS_FILE}.tmp", WATERMARKS_FILE)
+
+
+def publish(staging:str):
+    # Only complete part files are moved into the dataset, readers never see half a part
+    for root, _, files in os.walk(staging):
+        target = os.path.join(DATASET_DIR, os.path.relpath(root, staging))
+        for name in files:
+            os.makedirs(target, exist_ok=True)
+            os.replace(os.path.join(root, name), os.path.join(target, name))
+    shutil.rmtree(staging)
+
+
+def ingest(source:str, watermarks:dict, rates) -> int:
+    """Normalize the rows of a source changed since its watermark into new part files
+
+    :return: int Ingested rows count"""
+    run = time.strftime("%Y%m%dT%H%M%S")
+    # Hidden from readers until published
+    staging = os.path.join(DATASET_DIR, f".staging-{source}-{run}")
+    chunks, watermark = SOURCES[source](watermarks.get(source))
+
+    rows = 0
+    for number, df in enumerate(chunks):
+        df = to_eur(df, ["start_price", "end_price"], rates)
+        ds.write_dataset(
+            pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False),
+            staging,
+            format="parquet",
+            partitioning=PARTITIONING,
+            basename_template=f"part-{run}-{number}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        rows += len(df)
+
+    if rows:
+        publish(staging)
+    # The watermark moves after its rows are published, a crash in between ingests them twice
+    watermarks[source] = watermark
+    write_watermarks(watermarks)
+    return rows
+
+
+def load_auctions(columns:list=None, filter=None):
+    """Read the auction dataset, the latest version of every lot
+
+    :param columns: list Columns to read, all without it
+    :param filter: pyarrow Expression, ex. ds.field("source") == "bidtoart"
+    :return: DataFrame"""
+    read = None if columns is None else list(dict.fromkeys(columns + ["source", "source_id", "updated_at"]))
+    # Parts written before a column was added read it as nulls
+    dataset = ds.dataset(DATASET_DIR, schema=SCHEMA, format="parquet", partitioning=PARTITIONING)
+    df = dataset.to_table(columns=read, filter=filter).to_pandas()
+    df = df.sort_values("updated_at", kind="stable").drop_duplicates(["source", "source_id"], keep="last")
+    return df if columns is None else df[columns]
+
+if __name__ == "__main__":
+    if not os.path.exists(RATES_PATH):
+        # Rows ingested without rates would never get their euro prices
+        sys.exit(f"{RATES_PATH} is missing, build it with fx_rates.py first")
+    rates = load_rates()
+
+    os.makedirs(DATASET_DIR, exist_ok=True)
+    watermarks = read_watermarks()
+    for source in sys.argv[1:] or list(SOURCES):
+        started = time.monotonic()
+        rows = ingest(source, watermarks, rates)
+        print(f"Ingested {rows} rows of {source!r} into {DATASET_DIR} in {time.monotonic() - started:.1f} seconds")
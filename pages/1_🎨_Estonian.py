@@ -1,7 +1,10 @@
 import streamlit as st
 import plotly.express as px
 import pandas as pd
-from StreamlitHelper import Toc, get_img_with_href, read_df, create_table
+from StreamlitHelper import Toc, get_img_with_href, read_df, read_cube, cube_version, create_cube_table, aggregate_cube, cube_overbid_range, map_category_returns
+from build_cube import prepare_auctions
+from data_store import dataset_version, replace_value
+from scrapers.common.dimensions import to_square_meters
 
 st.set_page_config(
     page_title="Art Index",
@@ -37,16 +40,20 @@ def create_paragraph(text):
 toc = Toc()
 toc.placeholder(sidebar=True)
 
-df = read_df('data/auctions_clean.csv')
-df = df[df["date"] >= 2001]
-df = df[df["date"] <= 2021]
-df = df.sort_values(by=["date"])
+# Only the columns plotted from raw rows, the rest comes from the cube
+PAGE_COLUMNS = ["date", "year", "decade", "author", "technique", "category", "end_price", "dimension"]
+df = prepare_auctions(read_df('data/auctions_clean.csv', columns=PAGE_COLUMNS))
+# Aggregates of the same rows, built offline with build_cube.py
+cube = read_cube("auctions").copy()
+# Cached tables of the relabelled cube must not be shared with the English page
+cube_key = (cube_version("auctions"), "et")
 df_hist = read_df('data/historical_avg_price.csv')
 df_hist = df_hist[df_hist["date"] >= 2001]
 df_hist = df_hist.groupby("date").sum()
 
 def change_value(change_from, change_to, column):
-    df.loc[df[column]==change_from, column] = change_to
+    for data in (df, cube):
+        replace_value(data, column, change_from, change_to)
 # Estonian categories and techniques
 change_value("Oil paintings", "Õlimaalid", "category")
 change_value("Other (non-oil) paintings", "Teised (mitte õli) maalid", "category")
@@ -107,7 +114,7 @@ create_paragraph('Ülalpoolne kunstiindeks annab ülevaate kunsti hinna tõusust
 
 # TABLE - categories average price
 toc.subheader('Tabel - Ajalooline hinnanäitaja kategooriate kaupa')
-table_data = create_table(df, category_column="category", category_list=df["category"].unique(), calculate_volume=False, table_height=150)
+table_data = create_cube_table(cube, category_column="category", category_list=cube["category"].unique(), calculate_volume=False, table_height=150, version=cube_key)
 st.table(table_data)
 create_paragraph('Meediumite ehk tehnika järgi järjestud vastavalt sellele, missugused meediumid domineerivad kõige kallimalt müüdud teoste hulgas.')
 
@@ -126,24 +133,21 @@ Näiteks 2001 aastal oli oksjoni käive 174 000- euro ringis, siis 2021 aastal o
 
 # TABLE - categories volume
 toc.subheader('Tabel - Ajalooline volüümi kasv kategooriate kaupa')
-table_data = create_table(df, category_column="category", category_list=df["category"].unique(), calculate_volume=True, table_height=150)
+table_data = create_cube_table(cube, category_column="category", category_list=cube["category"].unique(), calculate_volume=True, table_height=150, version=cube_key)
 st.table(table_data)
 create_paragraph('Sellest tabelist näeme, milline meedium on olnud kõige suurema käibega. Antud andmete põhjal võime näiteks näha, et graafika on kõige populaarsem ning kõige suurema käibe tõusu protsendiga.(Keskmiselt 204% 20 aasta jooksul ja õlimaalil samal ajal 35%)')
 
 # FIGURE - treemap covering categories, techniques and authors by volume and overbid
 toc.subheader('Joonis - Kunsti müügid kategooria ja kunstniku järgi')
 
-df['start_price'] = df['start_price'].fillna(df['end_price'])
-df['overbid_%'] = (df['end_price'] - df['start_price'])/df['start_price'] * 100
 df['art_work_age'] = df['date'] - df['year']
-df2 = df.groupby(['author', 'technique', 'category']).agg({'end_price':['sum'], 'overbid_%':['mean']})
-df2.columns = ['total_sales', 'overbid_%']
-df2 = df2.reset_index()
+df2 = aggregate_cube(cube, ['author', 'technique', 'category'])
+overbid_mean, overbid_std = cube_overbid_range(cube)
 
 fig = px.treemap(df2, path=[px.Constant("Categories"), 'category', 'technique', 'author'], values='total_sales',
                   color='overbid_%',
                   color_continuous_scale='RdBu',
-                  range_color = (0, df['overbid_%'].mean() + df['overbid_%'].std()),
+                  range_color = (0, overbid_mean + overbid_std),
                   labels={
                      "overbid_%": "Ülepakkumine (%)",
                      "total_sales": "Kogumüük",
@@ -160,12 +164,9 @@ Näiteks sinise tooniga on kunstnikud ja meediumid, mille puhul on oksjonil algh
 # FIGURE - treemap covering categories, techniques and authors by volume and overbid
 toc.subheader('Joonis - Kunsti müügid kategooria ja kunstniku järgi')
 
-table_data = create_table(df, category_column="author", category_list=list(df["author"].unique()), calculate_volume=False, table_height=250)
-df["yearly_performance"] = [table_data[table_data["Kategooria"] == x]["Iga-aastane kasv (%)"] for x in df["author"]]
-df['art_work_age'] = df['date'] - df['year']
-df2 = df.groupby(['author', 'technique', 'category']).agg({'end_price':['sum'], 'yearly_performance':['mean']})
-df2.columns = ['total_sales', 'yearly_performance']
-df2 = df2.reset_index()
+table_data = create_cube_table(cube, category_column="author", category_list=list(cube["author"].unique()), calculate_volume=False, table_height=250, version=cube_key)
+df2 = aggregate_cube(cube, ['author', 'technique', 'category'])
+df2['yearly_performance'] = map_category_returns(df2['author'], table_data)
 
 fig = px.treemap(df2, path=[px.Constant("Categories"), 'category', 'technique', 'author'], values='total_sales',
                   color='yearly_performance',
@@ -183,11 +184,11 @@ create_paragraph('''...
 ''')
 
 # TABLE - best authors average price
-author_sum = df.groupby(["author"], sort=False)["end_price"].sum()
+author_sum = aggregate_cube(cube, ["author"]).set_index("author")["total_sales"]
 top_authors = author_sum.sort_values(ascending=False)[:10]
 
 toc.subheader('Tabel - Top 10 parimat kunstnikku')
-table_data = create_table(df, category_column="author", category_list=top_authors.index, calculate_volume=False, table_height=250)    
+table_data = create_cube_table(cube, category_column="author", category_list=top_authors.index, calculate_volume=False, table_height=250, version=cube_key)
 st.table(table_data)
 create_paragraph('''Selles tabelis on näha, millised kunstnikud on kõige populaarsemad ning nende kasvuprotsent. Protsent on arvutatud aastate vältel keskmise haamrihinna põhjal.
 
@@ -196,7 +197,7 @@ Selles tabelis on esikohal Konrad Mägi, kelle teoste väärtuse kasvuprotsent o
 
 # TABLE - best authors volume
 toc.subheader('Tabel - Volüümi kasv Top 10 kunstnikul')
-table_data = create_table(df, category_column="author", category_list=top_authors.index, calculate_volume=True, table_height=250)    
+table_data = create_cube_table(cube, category_column="author", category_list=top_authors.index, calculate_volume=True, table_height=250, version=cube_key)
 st.table(table_data)
 create_paragraph('''Siin on näha kunstnike teoste käive ning selle keskmine tõus aastas. Antud tabelis on Wiiralt kaheksandal kohal ja esimesel Konrad Mägi. Kuna tabelis esitatud protsent on kogu perioodi (2001-2021) käibe peale, siis need kunstnikud, kelle töid on müüdud rohkem on sattunud ka tabeli etteotsa.
 ''')
@@ -223,7 +224,7 @@ Kõige vanem teos pärineb aastast 1900, kuid ei ole kõige kallimalt müüdud.
 
 # FIGURE - size and price
 toc.subheader('Joonis - Kunstitöö pindala vs hind')
-df["dimension"] = df["dimension"] / (1000*1000)
+df["dimension"] = to_square_meters(df["dimension"], "mm2")
 fig = px.scatter(df.dropna(subset=["dimension"]), x="dimension", y="end_price", color="category",
                  animation_frame="date", animation_group="technique", hover_name="technique",
                  size='date', hover_data=['author'], size_max=15, range_x=[-0.03,0.35], range_y=[-1000,100000],
@@ -246,10 +247,10 @@ create_credits('''Allikad: Eesti avalikud kunsti oksjonid (2001-2021)''')
 create_credits('''Muu: Inspireeritud Riivo Antoni loodud kunstiindeksist; <br>Heldet toetust pakkus <a href="https://tezos.foundation/">Tezos Foundation</a>''')
 toc.generate()
 
-@st.cache
-def convert_df():
+@st.cache_data
+def convert_df(version):
     # IMPORTANT: Cache the conversion to prevent computation on every rerun
     return read_df('data/auctions_clean.csv').to_csv().encode('utf-8')
 
-csv = convert_df()
+csv = convert_df(dataset_version('data/auctions_clean.csv'))
 st.download_button(label="Laadi alla andmed",data=csv, file_name='eesti_kunsti_indeks.csv', mime='text/csv')
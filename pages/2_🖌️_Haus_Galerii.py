@@ -1,7 +1,10 @@
 import streamlit as st
 import plotly.express as px
 import pandas as pd
-from StreamlitHelper import Toc, get_img_with_href, read_df, create_table
+from StreamlitHelper import Toc, get_img_with_href, read_df, read_cube, cube_version, create_cube_table, aggregate_cube, cube_overbid_range, map_category_returns
+from build_cube import prepare_haus
+from data_store import dataset_version
+from scrapers.common.dimensions import to_square_meters
 
 st.set_page_config(
     page_title="Art Index",
@@ -37,11 +40,12 @@ def create_paragraph(text):
 toc = Toc()
 toc.placeholder(sidebar=True)
 
-df = read_df('data/haus_cleaned.csv')
-df = df[df["date"] >= 2001]
-df = df[df["date"] <= 2023]
-df = df.sort_values(by=["date"])
-df = df.dropna(subset=["author"])
+# Only the columns plotted from raw rows, the rest comes from the cube
+PAGE_COLUMNS = ["date", "year", "decade", "author", "technique", "category", "end_price", "dimension"]
+df = prepare_haus(read_df('data/haus_cleaned.csv', columns=PAGE_COLUMNS))
+# Aggregates of the same rows, built offline with build_cube.py
+cube = read_cube("haus")
+cube_key = cube_version("haus")
 
 kanvas_logo = get_img_with_href('data/horisontal-BLACK.png', 'https://kanvas.ai', '200px')
 st.sidebar.markdown(kanvas_logo, unsafe_allow_html=True)
@@ -61,15 +65,9 @@ Kanvas.ai kunstiindeksist puuduvad oksjoniväline kunsti info kuid meil on plaan
 Kunstiindeksi metoodika on praegu väljatöötamisel. Soovituste ja kommentaaridega saatke meile e-kiri info@kanvas.ai.
 ''')
 
-prices = []
-volumes = []
-dates = []
-for year in range(df["date"].min(), df["date"].max()+1):
-    print(year)
-    dates.append(year)
-    prices.append(df[df["date"] == year]["end_price"].mean())
-    volumes.append(df[df["date"] == year]["end_price"].sum())
-data = {'avg_price': prices, 'volume': volumes, 'date': dates}
+yearly = aggregate_cube(cube, ["date"]).set_index("date")
+yearly = yearly.reindex(range(cube["date"].min(), cube["date"].max()+1))
+data = {'avg_price': yearly["avg_price"].values, 'volume': yearly["total_sales"].fillna(0).values, 'date': yearly.index}
 df_hist = pd.DataFrame.from_dict(data)
 
 # FIGURE - date and average price
@@ -85,7 +83,7 @@ create_paragraph('Tekst')
 
 # TABLE - categories average price
 toc.subheader('Tabel - Ajalooline hinnanäitaja kategooriate kaupa')
-table_data = create_table(df.dropna(subset=["date"]), category_column="category", category_list=df["category"].unique(), calculate_volume=False, table_height=150)
+table_data = create_cube_table(cube, category_column="category", category_list=cube["category"].unique(), calculate_volume=False, table_height=150, version=cube_key)
 st.table(table_data)
 create_paragraph('tekst')
 
@@ -103,25 +101,21 @@ create_paragraph('''tekst
 
 # TABLE - categories volume
 toc.subheader('Tabel - Ajalooline volüümi kasv kategooriate kaupa')
-table_data = create_table(df.dropna(subset=["date"]), category_column="category", category_list=df["category"].unique(), calculate_volume=True, table_height=150)
+table_data = create_cube_table(cube, category_column="category", category_list=cube["category"].unique(), calculate_volume=True, table_height=150, version=cube_key)
 st.table(table_data)
 create_paragraph('tekst')
 
 # FIGURE - treemap covering categories, techniques and authors by volume and overbid
 toc.subheader('Joonis - Kunsti müügid kategooria ja kunstniku järgi')
 
-df['start_price'] = df['start_price'].fillna(df['end_price'])
-df['overbid_%'] = (df['end_price'] - df['start_price'])/df['start_price'] * 100
 df['art_work_age'] = df['date'] - df['year']
-df2 = df[df["technique"] != " "]
-df2 = df2.groupby(['author', 'technique', 'category']).agg({'end_price':['sum'], 'overbid_%':['mean']})
-df2.columns = ['total_sales', 'overbid_%']
-df2 = df2.reset_index()
+df2 = aggregate_cube(cube[cube["technique"] != " "], ['author', 'technique', 'category'])
+overbid_mean, overbid_std = cube_overbid_range(cube)
 
 fig = px.treemap(df2, path=[px.Constant("Categories"), 'category', 'technique', 'author'], values='total_sales',
                   color='overbid_%',
                   color_continuous_scale='RdBu',
-                  range_color = (0, df['overbid_%'].mean() + df['overbid_%'].std()),
+                  range_color = (0, overbid_mean + overbid_std),
                   labels={
                      "overbid_%": "Ülepakkumine (%)",
                      "total_sales": "Kogumüük",
@@ -136,12 +130,9 @@ create_paragraph('''tekst
 # FIGURE - treemap covering categories, techniques and authors by volume and overbid
 toc.subheader('Joonis - Kunsti müügid kategooria ja kunstniku järgi')
 
-table_data = create_table(df, category_column="author", category_list=list(df["author"].unique()), calculate_volume=False, table_height=250)
-df["yearly_performance"] = [table_data[table_data["Kategooria"] == x]["Iga-aastane kasv (%)"] for x in df["author"]]
-df['art_work_age'] = df['date'] - df['year']
-df2 = df.groupby(['author', 'technique', 'category']).agg({'end_price':['sum'], 'yearly_performance':['mean']})
-df2.columns = ['total_sales', 'yearly_performance']
-df2 = df2.reset_index()
+table_data = create_cube_table(cube, category_column="author", category_list=list(cube["author"].unique()), calculate_volume=False, table_height=250, version=cube_key)
+df2 = aggregate_cube(cube, ['author', 'technique', 'category'])
+df2['yearly_performance'] = map_category_returns(df2['author'], table_data)
 
 fig = px.treemap(df2, path=[px.Constant("Categories"), 'category', 'technique', 'author'], values='total_sales',
                   color='yearly_performance',
@@ -159,18 +150,18 @@ create_paragraph('''...
 ''')
 
 # TABLE - best authors average price
-author_sum = df.groupby(["author"], sort=False)["end_price"].sum()
+author_sum = aggregate_cube(cube, ["author"]).set_index("author")["total_sales"]
 top_authors = author_sum.sort_values(ascending=False)[:10]
 
 toc.subheader('Tabel - Top 10 parimat kunstnikku')
-table_data = create_table(df, category_column="author", category_list=top_authors.index, calculate_volume=False, table_height=250)    
+table_data = create_cube_table(cube, category_column="author", category_list=top_authors.index, calculate_volume=False, table_height=250, version=cube_key)
 st.table(table_data)
 create_paragraph('''tekst
 ''')
 
 # TABLE - best authors volume
 toc.subheader('Tabel - Volüümi kasv Top 10 kunstnikul')
-table_data = create_table(df, category_column="author", category_list=top_authors.index, calculate_volume=True, table_height=250)    
+table_data = create_cube_table(cube, category_column="author", category_list=top_authors.index, calculate_volume=True, table_height=250, version=cube_key)
 st.table(table_data)
 create_paragraph('''tekst
 ''')
@@ -195,7 +186,7 @@ create_paragraph('''tekst
 
 # FIGURE - size and price
 toc.subheader('Joonis - Kunstitöö pindala vs hind')
-df["dimension"] = df["dimension"] / (100*100)
+df["dimension"] = to_square_meters(df["dimension"], "cm2")
 df2 = df[df["technique"] != " "]
 fig = px.scatter(df2.dropna(subset=["dimension"]), x="dimension", y="end_price", color="category",
                  animation_frame="date", animation_group="technique", hover_name="technique",
@@ -219,10 +210,10 @@ create_credits('''Allikad: Haus kunsti oksjonid (2001-2022)''')
 create_credits('''Muu: Inspireeritud Riivo Antoni loodud kunstiindeksist; <br>Heldet toetust pakkus <a href="https://tezos.foundation/">Tezos Foundation</a>''')
 toc.generate()
 
-@st.cache
-def convert_df():
+@st.cache_data
+def convert_df(version):
     # IMPORTANT: Cache the conversion to prevent computation on every rerun
     return read_df('data/haus_cleaned.csv').to_csv().encode('utf-8')
 
-csv = convert_df()
+csv = convert_df(dataset_version('data/haus_cleaned.csv'))
 st.download_button(label="Laadi alla andmed",data=csv, file_name='haus_kunsti_indeks.csv', mime='text/csv')
@@ -1,7 +1,6 @@
+import math
 import os
 import re
-from multiprocessing import Pool
-from time import sleep
 
 import dotenv
 import requests
@@ -13,6 +12,9 @@ from lxml import etree
 from tqdm.contrib.telegram import tqdm
 
 from core.telegram import log
+from common.crawl_state import DONE, FAILED, letter_stats, mark_pages, plan_pages
+from common.fetcher import Fetcher
+from common.http_cache import cached_get
 
 dotenv.read_dotenv()
 
@@ -22,8 +24,9 @@ import django
 
 django.setup()
 
-from lots.models import Art
+from lots.models import Art, CrawlPage
 
+SOURCE = "bidtoart"
 DEFAULT_SEARCH_URL = "https://bidtoart.com/advanced-search?filter=art&title={key}"
 DEFAULT_SEARCH_PAGE_URL = "https://bidtoart.com/advanced-search?filter=art&title={key}&page={page}"
 
@@ -33,12 +36,17 @@ PAGE_INFO_XPATH = '//h5'
 
 LOT_ROW_XPATH = '//tr[contains(@onmouseout, "Mouse")]'
 
+RESULTS_PER_PAGE = 20
 
-def save_page(*args):
-    page_num, key = args[0][0], args[0][1]
-    url = DEFAULT_SEARCH_PAGE_URL.format(key=key, page=page_num)
-    resp = requests.get(url)
-    soup = bs4.BeautifulSoup(resp.text, 'lxml')
+# Requests in flight at the start and at most, and requests per second sent to bidtoart.com
+CONCURRENCY = int(os.getenv("BIDTOART_CONCURRENCY") or 40)
+MAX_CONCURRENCY = int(os.getenv("BIDTOART_MAX_CONCURRENCY") or 80)
+RATE_PER_HOST = float(os.getenv("BIDTOART_RATE_PER_HOST") or 20)
+
+
+def parse_page(response, args):
+    page_num, key = args
+    soup = bs4.BeautifulSoup(response.text, 'lxml')
     arts = soup.findAll("div", {"class": "masonry-item"})
     art_objects = []
 
@@ -58,53 +66,49 @@ def save_page(*args):
             dimensions=dimensions_tag.text.strip().replace("\n          ", " ") if dimensions_tag else None,
         ))
 
-    Art.objects.bulk_create(art_objects, ignore_conflicts=True)
-
+    return page_num, response.status, art_objects
 
-trans = str.maketrans(string.ascii_lowercase, string.ascii_lowercase[1:] + "a")
 
 if __name__ == "__main__":
+    # Search pages gain new arts, only cached for the short listing TTL
+    fetcher = Fetcher(concurrency=CONCURRENCY, max_concurrency=MAX_CONCURRENCY, rate=RATE_PER_HOST, listing=True)
     log("[Bid To Art] First stage started")
     for letter in string.ascii_lowercase:
-        next_letter = letter.translate(trans)
-
-        # If lots with next letter more than 5000, then skip
-        if Art.objects.filter(letter=next_letter).count() > 5000 and next_letter != "a":
-            log(f"[Bid To Art] Skipping letter: {letter}, because {next_letter!r} exists")
-            sleep(1)
-            continue
-
         log(f"[Bid To Art] Scraping letter: {letter}")
 
-        response = requests.get(DEFAULT_SEARCH_URL.format(key=letter))
+        # The live total, a letter whose pages are all done can have gained new ones
+        response = cached_get(DEFAULT_SEARCH_URL.format(key=letter), listing=True)
         tree = etree.HTML(response.text)
         page_info = tree.xpath(PAGE_INFO_XPATH)[0].text.strip().replace(",", "")
 
         total_results = int(re.findall(PAGE_INFO_REGEX, page_info)[0])
-        total_pages = total_results // 20
-
-        lot_amount = Art.objects.filter(letter=letter).count()
+        total_pages = math.ceil(total_results / RESULTS_PER_PAGE)
 
-        # If lot amount is greater than total results by 95% or more, skip
-        if lot_amount > total_results * 0.95:
-            log(f"[Bid To Art] Skipping letter: {letter}, because art amount is greater than total results by 95% or more")
-            sleep(1)
+        # Only the pages that are not saved yet, failed ones are retried
+        pages = plan_pages(CrawlPage, SOURCE, letter, total_pages)
+        log(f"[Bid To Art] Total pages: {total_pages}, pages to fetch: {len(pages)}")
+        if not pages:
             continue
 
-        # Get the latest page
-        latest_page = lot_amount // 30 + 1
-
-        if latest_page > 1:
-            log(f"[Bid To Art] Total pages: {total_pages}, latest page: {latest_page}")
-
-        gen_args = [(page, letter) for page in range(latest_page, total_pages + 1)]
-
-        with Pool(40) as p:
-            list(tqdm(
-                p.imap(save_page, gen_args),
-                total=total_pages - latest_page + 1,
-                desc=f"[Bid To Art] Scraping progress",
-                token=os.getenv("TELEGRAM_TOKEN"),
-                chat_id=os.getenv("TELEGRAM_CHAT_ID"),
-                mininterval=5,
-            ))
+        jobs = (
+            (DEFAULT_SEARCH_PAGE_URL.format(key=letter, page=page), (page, letter))
+            for page in pages
+        )
+
+        progress = tqdm(
+            # A page without arts slows the fetcher down, the site is likely struggling
+            fetcher.map(jobs, parse_page, is_empty=lambda result: not result[2]),
+            total=len(pages),
+            desc=f"[Bid To Art] Scraping progress",
+            token=os.getenv("TELEGRAM_TOKEN"),
+            chat_id=os.getenv("TELEGRAM_CHAT_ID"),
+            mininterval=5,
+        )
+        for page, status, art_objects in progress:
+            Art.objects.bulk_create(art_objects, ignore_conflicts=True)
+            # A page without arts is a soft block or an error page, retried on the next run
+            mark_pages(CrawlPage, SOURCE, letter, [page], DONE if status == 200 and art_objects else FAILED)
+            progress.set_postfix_str(str(fetcher.controller), refresh=False)
+
+        stats = letter_stats(CrawlPage, SOURCE, letter)
+        log(f"[Bid To Art] Letter {letter}: {stats[DONE]} pages done, {stats[FAILED]} failed")
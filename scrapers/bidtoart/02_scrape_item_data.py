@@ -1,7 +1,6 @@
 import os
 import re
 import uuid
-from multiprocessing import Pool
 from urllib.parse import urljoin
 
 import requests
@@ -16,6 +15,8 @@ from lxml import etree
 from tqdm.contrib.telegram import tqdm
 
 from core.telegram import log
+from common.db import BulkUpdater, iterate_in_chunks
+from common.fetcher import Fetcher
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 
@@ -25,21 +26,39 @@ django.setup()
 from lots.models import Art
 
 
-def scrape_information(art):
-    art.scrape()
+# Requests in flight at the start and at most, and requests per second sent to bidtoart.com
+CONCURRENCY = int(os.getenv("BIDTOART_CONCURRENCY") or 40)
+MAX_CONCURRENCY = int(os.getenv("BIDTOART_MAX_CONCURRENCY") or 80)
+RATE_PER_HOST = float(os.getenv("BIDTOART_RATE_PER_HOST") or 20)
+# Arts written per transaction
+BATCH_SIZE = int(os.getenv("BIDTOART_BATCH_SIZE") or 500)
+
+
+def scrape_information(response, art):
+    return art.parse(response.text)
 
 
 if __name__ == "__main__":
     arts = Art.objects.filter(has_info_downloaded=False, is_scraped=False)
+    total = arts.count()
 
-    log(f"[BIDTOART] Stage 2: Scraping {arts.count()} arts")
+    log(f"[BIDTOART] Stage 2: Scraping {total} arts")
 
-    with Pool(40) as p:
-        list(tqdm(
-            p.imap(scrape_information, arts),
-            total=arts.count(),
+    fetcher = Fetcher(concurrency=CONCURRENCY, max_concurrency=MAX_CONCURRENCY, rate=RATE_PER_HOST)
+    jobs = ((art.full_url, art) for art in iterate_in_chunks(arts))
+
+    with BulkUpdater(Art, Art.SCRAPED_FIELDS, batch_size=BATCH_SIZE) as writer:
+        progress = tqdm(
+            # Art pages without the info table slow the fetcher down
+            fetcher.map(jobs, scrape_information, is_empty=lambda art: not art.has_info_downloaded),
+            total=total,
             desc=f"[BIDTOART] Scraping progress",
             token=os.getenv("TELEGRAM_TOKEN"),
             chat_id=os.getenv("TELEGRAM_CHAT_ID"),
             mininterval=5,
-            ))
+        )
+        for art in progress:
+            writer.add(art)
+            progress.set_postfix_str(f"{writer}, {fetcher.controller}", refresh=False)
+
+    log(f"[BIDTOART] Stage 2: Done, {writer}")
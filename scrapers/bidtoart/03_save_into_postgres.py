@@ -1,19 +1,17 @@
+import csv
+import io
 import os
 import re
-import uuid
-from multiprocessing import Pool
-from urllib.parse import urljoin
-
-import requests
-import bs4
-import lxml
-import string
+import sys
+import time
+from datetime import datetime
+from itertools import islice
+
 import dotenv
+import pandas as pd
 import psycopg2
 
-from django.db import transaction
 from django.core.paginator import Paginator
-from lxml import etree
 # from tqdm.contrib.telegram import tqdm
 from tqdm import tqdm
 
@@ -25,6 +23,7 @@ import django
 django.setup()
 
 from lots.models import Art
+from common.dimensions import parse_dimensions
 from core.telegram import log
 
 
@@ -32,24 +31,163 @@ DATABASE_NAME = os.getenv("DATABASE_NAME")
 CONNECTION = psycopg2.connect(
     f"dbname={DATABASE_NAME} user=postgres"
 )
-CONNECTION.autocommit = True
 CURSOR = CONNECTION.cursor()
 
+# Typed table filled by COPY, url is the upsert key so the export can be re-run
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS arts (
+    url TEXT PRIMARY KEY,
+    art_id BIGINT NOT NULL,
+    auction_date DATE,
+    auction_year SMALLINT,
+    author TEXT,
+    title TEXT,
+    start_price NUMERIC,
+    end_price NUMERIC,
+    currency TEXT,
+    decade SMALLINT,
+    technique TEXT,
+    source TEXT,
+    category TEXT,
+    dimension DOUBLE PRECISION
+);
+CREATE TEMP TABLE arts_staging (LIKE arts) ON COMMIT DROP;
+"""
+
+COLUMNS = [
+    "url", "art_id", "auction_date", "auction_year", "author", "title", "start_price", "end_price",
+    "currency", "decade", "technique", "source", "category", "dimension",
+]
+
+UPSERT = f"""
+INSERT INTO arts ({", ".join(COLUMNS)})
+SELECT DISTINCT ON (url) {", ".join(COLUMNS)} FROM arts_staging ORDER BY url, art_id DESC
+ON CONFLICT (url) DO UPDATE SET {", ".join(f"{c} = EXCLUDED.{c}" for c in COLUMNS[1:])};
+"""
+
+# Rows whose dimensions are parsed in one pass
+AREA_BATCH_SIZE = 5000
+
+AUCTION_DATE_FORMATS = ["%b %d, %Y", "%B %d, %Y", "%d %b, %Y", "%d %B, %Y"]
+
+
+def to_number(value):
+    # "1,200" or "1 200.50" into 1200 / 1200.50
+    value = re.sub(r"[^\d.]", "", value or "")
+    return value if re.fullmatch(r"\d+(\.\d+)?", value) else None
+
+
+def to_year(value):
+    value = (value or "").strip()
+    return value if re.fullmatch(r"\d{4}", value) else None
+
+
+def to_date(value):
+    for date_format in AUCTION_DATE_FORMATS:
+        try:
+            return datetime.strptime((value or "").strip(), date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_areas(dimensions):
+    """Areas of a batch of dimension strings
+
+    :return: list of float cm2, None where unknown"""
+    areas = parse_dimensions(pd.Series(dimensions, dtype=object))["area_cm2"]
+    return [None if pd.isna(area) else area for area in areas]
+
+
+def copy_rows(arts):
+    arts = iter(arts)
+    while batch := list(islice(arts, AREA_BATCH_SIZE)):
+        areas = parse_areas([row[-1] for row in batch])
+        for (pk, url, auction_date, auction_year, artist, title, start_price, end_price, currency,
+             decade, technology, source, category, _), area in zip(batch, areas):
+            yield [
+                url, pk, to_date(auction_date), to_year(auction_year), artist, title,
+                to_number(start_price), to_number(end_price), currency, to_year(decade),
+                technology, source, category, area,
+            ]
+
+
+class CsvStream(io.TextIOBase):
+    """File-like object that renders rows as csv while COPY reads from it"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.buffer = ""
+        self.line = io.StringIO()
+        self.writer = csv.writer(self.line)
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.writer.writerow(row)
+            self.buffer += self.line.getvalue()
+            self.line.seek(0)
+            self.line.truncate()
+            self.count += 1
+
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+def copy_into_postgres(arts):
+    """Stream the arts through COPY into a staging table and upsert them in one transaction
+
+    :return: int Copied rows count"""
+    stream = CsvStream(copy_rows(arts))
+    with CONNECTION:
+        CURSOR.execute(CREATE_TABLE)
+        CURSOR.copy_expert(f"COPY arts_staging ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", stream)
+        CURSOR.execute(UPSERT)
+    return stream.count
+
 
 def save_into_postgres(items):
+    items = list(items)
+    for item, area in zip(items, parse_areas([item.dimensions for item in items])):
+        # Fills the cached Art.area read by postgres_insert_query
+        item.area = area
     sql = "\n".join([item.postgres_insert_query for item in items])
     CURSOR.execute(sql)
 
 
 if __name__ == "__main__":
-    page_amount = 100
     arts = Art.objects.filter(has_info_downloaded=True, is_scraped=True)
-    log(f"[BIDTOART] Stage 4: Total {arts.count()} arts to save into postgres.\n"
-    f"Estimated time: {arts.count() / 4 / page_amount / 60 :2f} minutes.")
+    # One count, read from the partial index of the scraped arts
+    total = arts.count()
+
+    if "--insert" in sys.argv:
+        # Old export into the VARCHAR items table described on Art
+        CONNECTION.autocommit = True
+        page_amount = 100
+        log(f"[BIDTOART] Stage 4: Total {total} arts to save into postgres.\n"
+        f"Estimated time: {total / 4 / page_amount / 60 :2f} minutes.")
+
+        p = Paginator(arts, page_amount)
 
-    p = Paginator(arts, page_amount)
+        for page in tqdm(p.page_range):
+            save_into_postgres(p.page(page).object_list)
 
-    for page in tqdm(p.page_range):
-        save_into_postgres(p.page(page).object_list)
+        log("[BIDTOART] Stage 4: Done.")
+        exit()
 
-    log("[BIDTOART] Stage 4: Done.")
+    log(f"[BIDTOART] Stage 4: Copying {total} arts into postgres table 'arts'.")
+    started = time.monotonic()
+    rows = arts.values_list(
+        "pk", "url", "auction_date", "auction_year", "artist", "title", "start_price", "end_price",
+        "currency", "decade", "technology", "source", "category", "dimensions",
+    ).iterator(chunk_size=5000)
+    copied = copy_into_postgres(tqdm(rows, total=total, desc="[BIDTOART] Copy progress", mininterval=5))
+    log(f"[BIDTOART] Stage 4: Done, {copied} arts copied in {time.monotonic() - started:.1f} seconds.")
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lots', '0003_art_auction_date_art_auction_year_art_category_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrawlPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=32)),
+                ('letter', models.CharField(max_length=16)),
+                ('page', models.IntegerField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'abstract': False,
+                'indexes': [models.Index(fields=['source', 'letter', 'status'], name='lots_crawlpage_status')],
+                'constraints': [models.UniqueConstraint(fields=('source', 'letter', 'page'), name='lots_crawlpage_unique_page')],
+            },
+        ),
+    ]
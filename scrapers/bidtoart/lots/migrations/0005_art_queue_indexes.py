@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lots', '0004_crawlpage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='art',
+            index=models.Index(condition=models.Q(('has_info_downloaded', False), ('is_scraped', False)), fields=['id'], name='lots_art_to_scrape'),
+        ),
+        migrations.AddIndex(
+            model_name='art',
+            index=models.Index(condition=models.Q(('has_info_downloaded', True), ('is_scraped', True)), fields=['id'], name='lots_art_scraped'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lots', '0005_art_queue_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='art',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
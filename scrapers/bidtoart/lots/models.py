@@ -1,11 +1,15 @@
-import re
+from functools import cached_property
 from urllib.parse import urljoin
 
-import math
 import requests
 import bs4
 
 from django.db import models
+from django.db.models import Q
+
+from common.crawl_state import CrawlPageBase
+from common.dimensions import parse_area
+from common.http_cache import cached_get
 
 
 class Art(models.Model):
@@ -31,6 +35,26 @@ class Art(models.Model):
 
     has_info_downloaded = models.BooleanField(default=False)
     is_scraped = models.BooleanField(default=False)
+    # Watermark of the ingestion into data/auctions, see ingest.py
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    # Fields filled by parse(), written back in bulk by stage 2
+    SCRAPED_FIELDS = [
+        "auction_date", "auction_year", "start_price", "end_price", "currency",
+        "decade", "source", "category", "has_info_downloaded", "is_scraped",
+    ]
+
+    class Meta:
+        indexes = [
+            # Partial indexes of the stage queues, stage 2 walks the unscraped arts
+            # by pk and stage 3 exports the scraped ones
+            models.Index(
+                fields=["id"], condition=Q(has_info_downloaded=False, is_scraped=False), name="lots_art_to_scrape",
+            ),
+            models.Index(
+                fields=["id"], condition=Q(has_info_downloaded=True, is_scraped=True), name="lots_art_scraped",
+            ),
+        ]
 
     """
     --- Postgres create table
@@ -59,33 +83,29 @@ class Art(models.Model):
     def technique(self):
         return self.technology
 
-    @property
+    @cached_property
     def area(self):
-        # 1.4 cm - 93.8 cm (0.55 in - 36.93 in)
-        # regex for 1.4 cm - 93.8 cm to get 1.4 and 93.8
-        dim = self.dimensions
-        # remove inch area if present
-        if dim.find("(") != -1:
-            dim = dim[:dim.find("(")]
-        res = re.findall(r"\d+\.\d+", dim)
-        # return multiplication of 1.4 and 93.8
-        return math.prod([float(x) for x in res])
+        return parse_area(self.dimensions)
 
     @property
     def full_url(self):
         return urljoin(self.BASE_URL, self.url)
 
     def scrape(self):
-        r = requests.get(self.full_url)
-        soup = bs4.BeautifulSoup(r.text, "lxml")
+        r = cached_get(self.full_url)
+        self.parse(r.text)
+        self.save()
+
+    def parse(self, html):
+        """Fill the auction fields from the art page html, without saving"""
+        soup = bs4.BeautifulSoup(html, "lxml")
 
         info = soup.find("table", {"class": "product-info"})
 
         if info is None:
             self.has_info_downloaded = False
             self.is_scraped = True
-            self.save()
-            return
+            return self
 
         trs = info.findAll("tr")
 
@@ -134,7 +154,7 @@ class Art(models.Model):
 
         self.has_info_downloaded = True
         self.is_scraped = True
-        self.save()
+        return self
 
     @property
     def safe_title(self):
@@ -179,4 +199,8 @@ class Art(models.Model):
             '{self.safe_source}',
             '{self.area}'
         );""".replace("None", "NULL")
-    
\ No newline at end of file
+    
+
+
+class CrawlPage(CrawlPageBase):
+    """Search page of 01_scrape_urls.py, see common.crawl_state"""
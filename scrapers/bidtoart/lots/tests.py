@@ -1,3 +1,39 @@
-from django.test import TestCase
+import math
 
-# Create your tests here.
+import pandas as pd
+from django.test import SimpleTestCase
+
+from common.dimensions import parse_dimensions
+
+
+class ParseDimensionsTest(SimpleTestCase):
+    def parse(self, dimensions: str, default_unit: str = "cm") -> tuple:
+        row = parse_dimensions(pd.Series([dimensions], dtype=object), default_unit).iloc[0]
+        return row["width_cm"], row["height_cm"], row["area_cm2"]
+
+    def assertSize(self, dimensions: str, width: float, height: float, default_unit: str = "cm"):
+        parsed_width, parsed_height, area = self.parse(dimensions, default_unit)
+        self.assertAlmostEqual(parsed_width, width, msg=dimensions)
+        self.assertAlmostEqual(parsed_height, height, msg=dimensions)
+        self.assertAlmostEqual(area, width * height, msg=dimensions)
+
+    def test_comma_separators(self):
+        self.assertSize("1,200 x 800 mm", 120, 80)
+        self.assertSize("40,5 x 50 cm", 40.5, 50)
+        self.assertSize("40,5 × 50 cm", 40.5, 50)
+
+    def test_dash_joined_sides(self):
+        self.assertSize("1.4 cm - 93.8 cm (0.55 in - 36.93 in)", 1.4, 93.8)
+
+    def test_numbers_before_the_size(self):
+        self.assertSize("2010-2012, 40 x 50 cm", 40, 50)
+        self.assertSize("Lot 12 - 40 x 50 cm", 40, 50)
+        self.assertSize("Signed 1923, 40 x 50 cm", 40, 50)
+
+    def test_year_range_is_not_a_size(self):
+        self.assertTrue(all(math.isnan(value) for value in self.parse("Executed in 1998-2000")))
+
+    def test_units_per_side(self):
+        self.assertSize("7.28 x 4.72 in", 7.28 * 2.54, 4.72 * 2.54)
+        self.assertSize("30 cm x 20 in", 30, 50.8)
+        self.assertSize("40 cm x 50", 40, 50, default_unit="in")
@@ -1,14 +1,18 @@
 """This script was created for downloading lots from Bukowskis.com
 and saving them to the database.
 
-It will scrape the art archive page and store all lot ids in the database."""
+It will scrape the art archive page and store all lot ids in the database.
+The next pages are downloaded while the previous ones are parsed and saved. Pages in
+flight start at BUKOWSKIS_CONCURRENCY and adapt up to BUKOWSKIS_MAX_CONCURRENCY,
+with at most BUKOWSKIS_RATE_PER_HOST requests per second."""
 
 
 # Prepare Django
+import itertools
 import os
-import time
 
 import django
+from faker import Faker
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 django.setup()
@@ -16,30 +20,67 @@ django.setup()
 # Import Django models
 
 # Import Bukowskis.com scraping services
+from common.fetcher import Fetcher
+from data.services.cookies import get_cookies
 from data.services.pages import ArchiveArtPage, save_ids_to_database
 
 ERROR_FILE = "01_error_{page}.html"
 
+# Pages in flight at the start and at most, and requests per second sent to bukowskis.com
+CONCURRENCY = int(os.getenv("BUKOWSKIS_CONCURRENCY") or 4)
+MAX_CONCURRENCY = int(os.getenv("BUKOWSKIS_MAX_CONCURRENCY") or 8)
+RATE_PER_HOST = float(os.getenv("BUKOWSKIS_RATE_PER_HOST") or 5)
+
+
+def parse_page(response, page_num):
+    page = ArchiveArtPage(page_num, response=response)
+    # Parse on the fetch thread, the main thread only writes to the database
+    page.html_items, page.has_next_page
+    return page
+
 
 if __name__ == "__main__":
+    # Known once a page without a next page or without items arrives
+    last_page = None
+
+    def jobs():
+        for page_num in itertools.count(1):
+            if last_page is not None and page_num > last_page:
+                return
+            yield ArchiveArtPage.URL.format(page=page_num), page_num
+
+    fetcher = Fetcher(
+        concurrency=CONCURRENCY,
+        max_concurrency=MAX_CONCURRENCY,
+        rate=RATE_PER_HOST,
+        headers={"User-Agent": Faker().user_agent()},
+        cookies=get_cookies(),
+        # Archive pages gain new lots, only cached for the short listing TTL
+        listing=True,
+    )
+    saved_pages = set()
+
     # Iterate archive pages
-    page = ArchiveArtPage(1)
-    while page.has_next_page:
-        time.sleep(0.2)
-        print("Saving page: {page}. ".format(page=page.page))
+    for page in fetcher.map(jobs(), parse_page, is_empty=lambda page: not page.item_ids):
+        if last_page is not None and page.page > last_page:
+            continue
 
         if len(page.item_ids) == 0:
             file = ERROR_FILE.format(page=page.page)
             print(f"No items on page: {page.page}. Saving the response into file {file}")
             with open(file, "w", encoding="utf-8") as f:
                 f.write(page.soup.prettify(formatter="html5"))
-            break
+            last_page = page.page - 1 if last_page is None else min(last_page, page.page - 1)
 
-        created = save_ids_to_database(page.item_ids_and_urls)
-        print(f"Created {created} of {len(page.item_ids)} items.")
-        page = ArchiveArtPage(page.page + 1)
+        else:
+            print("Saving page: {page}. ".format(page=page.page))
+            created = save_ids_to_database(page.item_ids_and_urls)
+            print(f"Created {created} of {len(page.item_ids)} items. Fetcher: {fetcher.controller}.")
+            saved_pages.add(page.page)
+            if not page.has_next_page:
+                print("Saved last page: {page}. ".format(page=page.page))
+                last_page = page.page if last_page is None else min(last_page, page.page)
 
-    else:
-        print("Saving last page: {page}. ".format(page=page.page))
-        created = save_ids_to_database(page.item_ids_and_urls)
-        print(f"Created {created} of {len(page.item_ids)} items.")
+        # Leaving the loop cancels the requests still in flight
+        if last_page is not None and saved_pages.issuperset(range(1, last_page + 1)):
+            break
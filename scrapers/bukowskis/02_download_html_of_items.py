@@ -19,12 +19,20 @@ django.setup()
 from data.models import Item
 
 # Import Bukowskis.com scraping services
-from data.services.items import BaseItem, save_file_to_disk
+from data.services.items import BaseItem, mark_file_exists, save_file_to_disk
+from data.services.store import get_lot_store
+
+from common.db import map_in_workers
+from common.writer import DbWriter, submit
 
 ERROR_FILE = "02_error_{id}.html"
 
 
 def download_and_save_item(item):
+    # Saved before its flag was lost, see save_file_to_disk
+    if item.lot_id in get_lot_store():
+        submit(mark_file_exists, item.pk)
+        return
     result = BaseItem(item).get_contents_to_save()
     try:
         if result:
@@ -45,5 +53,8 @@ if __name__ == "__main__":
     total = items.count()
     print(f"Found {total} items to download.")
 
-    with Pool(20) as p:
-        r = list(tqdm(p.imap_unordered(download_and_save_item, items), total=total))
+    # Workers load their items by pk range, the items are never pickled.
+    # Their flags go to the writer process, which commits many items at once
+    with DbWriter() as writer:
+        r = list(tqdm(map_in_workers(items, download_and_save_item, 20, chunk_size=50), total=total))
+    print(f"Done, {writer}.")
@@ -1,44 +1,167 @@
 """This script was created for scraping dowloaded html files and saving them to the csv file.
+
+Rows are written as the workers parse them. Every FLUSH_EVERY rows the output is flushed
+and the last written lot_id is checkpointed, so an interrupted run continues where it stopped:
+
+$ python 03_convert_to_csv.py            # data.csv, resumes from data.csv.checkpoint
+$ python 03_convert_to_csv.py --restart  # convert everything again
+$ python 03_convert_to_csv.py --parquet  # row groups in data_parquet/part-*.parquet
 """
 
 # Prepare Django
 import os
 import csv
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from multiprocessing.pool import ThreadPool, Pool
+import sys
 
 from tqdm import tqdm
 import django
-from tqdm_multi_thread import TqdmMultiThreadFactory
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 django.setup()
 
 from data.services.items import ItemParser
 
+from common.db import map_in_workers
+
 # Import Django models
 from data.models import Item
 
 
+HEADER = ["lot_id", "auction_date", "author", "start_price", "end_price", "currency", "lifetime", "category", "description"]
+CSV_FILE = "data.csv"
+PARQUET_DIR = "data_parquet"
+
+PROCESSES = 60
+# Items a worker loads with one query, large enough to keep the pipes quiet
+CHUNKSIZE = 64
+FLUSH_EVERY = 10000
+
+
 def get_csv_row(item):
-    return ItemParser(item).csv_row
+    return item.lot_id, ItemParser(item).csv_row
+
+
+def read_checkpoint(path: str):
+    """Read the last checkpoint
+
+    :param path: str
+    :return: tuple (last written lot_id, output size in bytes) or None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        lot_id, size = f.read().split()
+    return int(lot_id), int(size)
+
+
+def write_checkpoint(path: str, lot_id: int, size: int) -> None:
+    # Replace the file in one step, so a crash never leaves half a checkpoint
+    with open(f"{path}.tmp", "w") as f:
+        f.write(f"{lot_id} {size}")
+    os.replace(f"{path}.tmp", path)
+
+
+class CsvSink:
+    def __init__(self, path: str, checkpoint: tuple = None):
+        if checkpoint:
+            self.file = open(path, "r+", encoding="utf-8", newline="")
+            # Rows written after the checkpoint are converted again
+            self.file.truncate(checkpoint[1])
+            self.file.seek(checkpoint[1])
+            self.writer = csv.writer(self.file, delimiter=",")
+        else:
+            self.file = open(path, "w", encoding="utf-8", newline="")
+            self.writer = csv.writer(self.file, delimiter=",")
+            self.writer.writerow(HEADER)
+
+    def write(self, row: list) -> None:
+        self.writer.writerow(row)
+
+    def flush(self) -> int:
+        """Flush written rows to disk
+
+        :return: int Output size in bytes"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetSink:
+    def __init__(self, path: str, checkpoint: tuple = None):
+        import pyarrow as pa
+
+        self.pa = pa
+        self.path = path
+        # lot_id stays numeric, so readers can prune part files by its statistics
+        self.schema = pa.schema([("lot_id", pa.int64())] + [(column, pa.string()) for column in HEADER[1:]])
+        self.rows = []
+
+        os.makedirs(path, exist_ok=True)
+        if not checkpoint:
+            for name in os.listdir(path):
+                if name.startswith("part-"):
+                    os.remove(os.path.join(path, name))
+        self.parts = len([name for name in os.listdir(path) if name.endswith(".parquet")])
+
+    def write(self, row: list) -> None:
+        self.rows.append(row)
+
+    def flush(self) -> int:
+        """Write the buffered rows as one row group of a new part file
+
+        :return: int Always 0, parts are never truncated"""
+        import pyarrow.parquet as pq
+
+        if self.rows:
+            table = self.pa.Table.from_arrays(
+                [self.pa.array(column, field.type) for column, field in zip(zip(*self.rows), self.schema)],
+                schema=self.schema,
+            )
+            part = os.path.join(self.path, f"part-{self.parts:05d}.parquet")
+            # An unfinished part has no footer, only complete parts get their final name
+            pq.write_table(table, f"{part}.tmp", row_group_size=len(self.rows))
+            os.replace(f"{part}.tmp", part)
+            self.parts += 1
+            self.rows = []
+        return 0
+
+    def close(self) -> None:
+        self.flush()
 
 
 if __name__ == "__main__":
+    parquet = "--parquet" in sys.argv
+    output = PARQUET_DIR if parquet else CSV_FILE
+    checkpoint_file = f"{output}.checkpoint"
+
+    if "--restart" in sys.argv and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    checkpoint = read_checkpoint(checkpoint_file)
+    if checkpoint and not os.path.exists(output):
+        checkpoint = None
+
     # Iterate items
-    items = Item.objects.filter(is_file_exists=True)
+    items = Item.objects.filter(is_file_exists=True).order_by("lot_id", "pk")
+    if checkpoint:
+        print(f"Resuming after lot {checkpoint[0]}.")
+        items = items.filter(lot_id__gt=checkpoint[0])
     total = items.count()
-    print(f"Total {total} will be converted to csv.")
-
-    HEADER = ["auction_date", "author", "start_price", "end_price", "currency", "lifetime", "category", "description"]
+    print(f"Total {total} will be converted to {output}.")
 
-    csv_file = "data.csv"
-    with open(csv_file, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(f, delimiter=",")
-        writer.writerow(HEADER)
-        with Pool(60) as p:
-            r = list(tqdm(p.imap_unordered(get_csv_row, items), total=total))
+    sink = ParquetSink(output, checkpoint) if parquet else CsvSink(output, checkpoint)
+    written = 0
+    # Ordered results keep the lot_id order, so every lot up to the checkpoint is on disk
+    rows = map_in_workers(items, get_csv_row, PROCESSES, chunk_size=CHUNKSIZE, key="lot_id", ordered=True)
+    for lot_id, row in tqdm(rows, total=total):
+        sink.write([lot_id] + row)
+        written += 1
+        if written % FLUSH_EVERY == 0:
+            write_checkpoint(checkpoint_file, lot_id, sink.flush())
 
-        writer.writerows(r)
+    if written % FLUSH_EVERY:
+        write_checkpoint(checkpoint_file, lot_id, sink.flush())
+    sink.close()
 
-    print(f"Saved {total} items to {csv_file}.")
+    print(f"Saved {written} items to {output}.")
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Modules shared by all scrapers live in scrapers/common
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
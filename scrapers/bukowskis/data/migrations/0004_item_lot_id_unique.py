@@ -0,0 +1,39 @@
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+
+
+def remove_duplicate_lot_ids(apps, schema_editor):
+    # get_or_create without a constraint could save a lot twice, keep the first row
+    Item = apps.get_model("data", "Item")
+    ItemCategory = apps.get_model("data", "ItemCategory")
+    duplicates = Item.objects.values("lot_id").annotate(
+        count=Count("id"), first_id=Min("id"), has_file=Max("is_file_exists")
+    ).filter(count__gt=1)
+    for duplicate in duplicates:
+        Item.objects.filter(id=duplicate["first_id"]).update(is_file_exists=duplicate["has_file"])
+        others = Item.objects.filter(lot_id=duplicate["lot_id"]).exclude(id=duplicate["first_id"])
+        # Move the category links to the kept row before the delete cascades to them, once per category
+        categories = set(ItemCategory.objects.filter(item_id=duplicate["first_id"]).values_list("category", flat=True))
+        moved = []
+        for link_id, category in ItemCategory.objects.filter(item__in=others).order_by("id").values_list("id", "category"):
+            if category not in categories:
+                categories.add(category)
+                moved.append(link_id)
+        ItemCategory.objects.filter(id__in=moved).update(item_id=duplicate["first_id"])
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0003_item_url'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_lot_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='item',
+            name='lot_id',
+            field=models.IntegerField(unique=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0004_item_lot_id_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('is_file_exists', False)), fields=['id'], name='data_item_to_download'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('is_file_exists', True)), fields=['lot_id'], name='data_item_downloaded'),
+        ),
+    ]
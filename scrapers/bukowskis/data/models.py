@@ -3,13 +3,21 @@ from urllib.parse import urljoin
 
 from django.conf import settings
 from django.db import models
+from django.db.models import Q
 
 
 class Item(models.Model):
-    lot_id = models.IntegerField()
+    lot_id = models.IntegerField(unique=True)
     url = models.URLField(null=True, blank=True)
     is_file_exists = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Queues of stage 2, walked by pk, and of stage 3, walked by lot_id
+            models.Index(fields=["id"], condition=Q(is_file_exists=False), name="data_item_to_download"),
+            models.Index(fields=["lot_id"], condition=Q(is_file_exists=True), name="data_item_downloaded"),
+        ]
+
     @property
     def lot_url(self) -> str:
         return urljoin("https://www.bukowskis.com/", self.url)
@@ -20,7 +28,9 @@ class Item(models.Model):
 
     @property
     def lot_file_exists(self) -> bool:
-        return os.path.exists(self.lot_file)
+        from data.services.store import get_lot_store
+
+        return self.lot_id in get_lot_store() or os.path.exists(self.lot_file)
 
 
 class ItemCategory(models.Model):
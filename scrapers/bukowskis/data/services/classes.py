@@ -6,6 +6,8 @@ from faker import Faker
 from lxml import etree
 from requests import Response
 
+from common.http_cache import cached_get
+
 
 class BaseRequestHandler:
     URL = "https://google.com/"
@@ -22,7 +24,7 @@ class BaseRequestHandler:
         headers = {
             "User-Agent": self.faker.user_agent()
         }
-        return requests.get(self.URL, headers=headers)
+        return cached_get(self.URL, headers=headers)
 
     @property
     def content(self) -> str:
@@ -38,12 +40,12 @@ class BaseRequestHandler:
         :return: BeautifulSoup"""
         return bs4.BeautifulSoup(self.content, "html.parser")
 
-    @property
-    def etree(self) -> bs4.element.Tag:
-        """Get etree
+    @cached_property
+    def etree(self) -> etree._Element:
+        """Get etree, parsed by lxml straight from the response
 
         :return: etree"""
-        return etree.HTML(self.soup.prettify())
+        return etree.HTML(self.content)
 
     def __str__(self) -> str:
         return f"RequestHandler <url: {self.URL}>"
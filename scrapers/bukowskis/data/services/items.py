@@ -1,12 +1,14 @@
 from functools import cached_property
 
-import bs4
 import requests
 from lxml import etree
 from requests import Response
 
+from common.http_cache import cached_get
+from common.writer import submit
 from data.models import Item
 from data.services.classes import BaseRequestHandler
+from data.services.store import get_lot_store
 
 
 class BaseItem(BaseRequestHandler):
@@ -23,7 +25,8 @@ class BaseItem(BaseRequestHandler):
         headers = {
             "User-Agent": self.faker.user_agent()
         }
-        return requests.get(self.item.lot_url, headers=headers)
+        # The lot store keeps the page, a cached copy would only duplicate it
+        return cached_get(self.item.lot_url, headers=headers, store=False)
 
     def get_contents_to_save(self) -> str:
         """Get contents to save in html
@@ -34,65 +37,73 @@ class BaseItem(BaseRequestHandler):
 
 
 class ItemParser:
+    # Compiled once per process and evaluated on a single native lxml parse of the lot file
+    HTML_PARSER = etree.HTMLParser(encoding="utf-8")
+    CATEGORY_XPATH = etree.XPath("//div[@class='c-market-lot-show-navigation__category-and-id']//a")
+    AUTHOR_XPATH = etree.XPath("//h1[@class='c-lot-heading__title']")
+    LIFETIME_XPATH = etree.XPath("//div[@class='c-lot-show-header__artist-lifetime']")
+    HAMMER_PRICE_XPATH = etree.XPath("//div[contains(@class, 'c-market-lot-show-result__leading-amount')]")
+    ESTIMATE_XPATH = etree.XPath("//div[@class='c-market-lot-show-estimate__amount']")
+    DATE_TIME_XPATH = etree.XPath("//time[@class='c-market-lot-show-bidding-end-date']/@datetime")
+    DESCRIPTION_XPATH = etree.XPath(
+        "//div[contains(concat(' ', normalize-space(@class), ' '), ' c-lot-description ')]")
+
     def __init__(self, item: Item):
         self.item = item
 
     @cached_property
-    def contents(self):
+    def contents(self) -> bytes:
         """Get contents
 
-        :return: str"""
-        return open(self.item.lot_file, "r", encoding="utf-8").read()
+        :return: bytes"""
+        store = get_lot_store()
+        if self.item.lot_id in store:
+            return store.read(self.item.lot_id)
+        # Lots downloaded before the pack store
+        with open(self.item.lot_file, "rb") as f:
+            return f.read()
 
     @cached_property
-    def soup(self) -> bs4.BeautifulSoup:
-        """Get soup
-
-        :return: BeautifulSoup"""
-        return bs4.BeautifulSoup(self.contents, "html.parser")
-
-    @cached_property
-    def etree(self) -> bs4.element.Tag:
+    def etree(self) -> etree._Element:
         """Get etree
 
         :return: etree"""
-        return etree.HTML(self.soup.prettify())
+        return etree.fromstring(self.contents, self.HTML_PARSER)
 
     @cached_property
     def category(self) -> str:
         """Get category
 
         :return: str"""
-        return self.xpath_text("//div[@class='c-market-lot-show-navigation__category-and-id']//a", 1)
+        return self.xpath_text(self.CATEGORY_XPATH, 1)
 
     @cached_property
     def author(self) -> str:
         """Get author
 
         :return: str"""
-        return self.xpath_text("//h1[@class='c-lot-heading__title']")
+        return self.xpath_text(self.AUTHOR_XPATH)
 
     @cached_property
     def lifetime(self) -> str:
         """Get lifetime
 
         :return: str"""
-        return self.xpath_text("//div[@class='c-lot-show-header__artist-lifetime']")
+        return self.xpath_text(self.LIFETIME_XPATH)
 
     @cached_property
     def hammer_price(self) -> str:
         """Get hammer price
 
         :return: str"""
-        return self.xpath_text(
-            "//div[contains(@class, 'c-market-lot-show-result__leading-amount')]").replace("\xa0", "") or self.estimate
+        return self.xpath_text(self.HAMMER_PRICE_XPATH).replace("\xa0", "") or self.estimate
 
     @cached_property
     def full_estimate(self) -> list:
         """Get full estimate
 
         :return: list"""
-        return self.xpath_text("//div[@class='c-market-lot-show-estimate__amount']").rsplit('\xa0', 1)
+        return self.xpath_text(self.ESTIMATE_XPATH).rsplit('\xa0', 1)
 
     @cached_property
     def estimate(self) -> str:
@@ -113,15 +124,21 @@ class ItemParser:
         """Get date time
 
         :return: str"""
-        el = self.etree.xpath("//time[@class='c-market-lot-show-bidding-end-date']")
-        return el[0].attrib["datetime"] if el else ""
+        el = self.DATE_TIME_XPATH(self.etree)
+        return str(el[0]) if el else ""
 
     @cached_property
     def description(self) -> str:
         """Get description
 
         :return: str"""
-        return self.soup.find("div", {"class": "c-lot-description"}).text.strip()
+        el = self.DESCRIPTION_XPATH(self.etree)
+        if not el:
+            return ""
+        # Collapse whitespace-only strings the way BeautifulSoup did, so the csv keeps its line breaks
+        return "".join(
+            ("\n" if "\n" in text else " ") if text.isspace() else text for text in el[0].itertext()
+        ).strip()
 
     @cached_property
     def csv_row(self) -> list:
@@ -139,20 +156,25 @@ class ItemParser:
             self.description,
         ]
 
-    def xpath_text(self, path, idx=0):
-        el = self.etree.xpath(path)
-        return el[idx].text.strip() if len(el) > idx else ""
+    def xpath_text(self, path, idx=0) -> str:
+        el = path(self.etree)
+        # Text before the first child, None when the element starts with a tag
+        return (el[idx].text or "").strip() if len(el) > idx else ""
 
 
 def save_file_to_disk(item: Item, contents: str) -> None:
-    """Save lot html to disk
+    """Save lot html to the pack store
 
     :param item: Item
     :param contents: str
     :return: None
     """
 
-    with open(item.lot_file, "w", encoding="utf-8") as f:
-        f.write(contents)
-        item.is_file_exists = True
-        item.save()
+    get_lot_store().write(item.lot_id, contents.encode("utf-8"))
+    item.is_file_exists = True
+    # The lot is on disk before the flag is queued, a lost flag only means a second download
+    submit(mark_file_exists, item.pk)
+
+
+def mark_file_exists(item_pk: int) -> None:
+    Item.objects.filter(pk=item_pk).update(is_file_exists=True)
@@ -7,6 +7,7 @@ from faker import Faker
 from requests import Response
 from lxml import etree
 
+from common.http_cache import cached_get
 from data.models import Item
 from data.services.classes import BaseRequestHandler
 from data.services.cookies import get_cookies
@@ -18,8 +19,11 @@ class BasePage(BaseRequestHandler):
     ITEM_XPATH = "//div[@class='c-lot-index__lots']//div[contains(@id, 'lot')]"
     URL = "https://bukowskis.com/en/lots/page/{page}"
 
-    def __init__(self, page: int):
+    def __init__(self, page: int, response=None):
         self.page = page
+        if response is not None:
+            # Page already fetched, ex. by the pipelined crawler in 01_iterate_archive_pages.py
+            self.response = response
 
     @cached_property
     def response(self) -> Response:
@@ -30,7 +34,7 @@ class BasePage(BaseRequestHandler):
             "User-Agent": self.faker.user_agent()
         }
         cookies = get_cookies()
-        return requests.get(self.URL.format(page=self.page), headers=headers, cookies=cookies)
+        return cached_get(self.URL.format(page=self.page), headers=headers, cookies=cookies, listing=True)
 
     @cached_property
     def html_items(self):
@@ -87,16 +91,14 @@ class ArchiveArtPage(BasePage):
 
 @transaction.atomic
 def save_ids_to_database(lot_info: dict) -> int:
-    """Save lot ids to database
+    """Save lot ids to database, lots that are already saved are skipped
 
-    :param lot_info: dict
+    :param lot_info: dict lot_id -> url, one page or a buffer of pages
     :return: int Created items count"""
 
-    created_count = 0
-
-    for lot_id in lot_info:
-        item, created = Item.objects.get_or_create(lot_id=lot_id, defaults={"url": lot_info[lot_id]})
-        if created:
-            created_count += 1
-
-    return created_count
+    existing_count = Item.objects.filter(lot_id__in=list(lot_info)).count()
+    Item.objects.bulk_create(
+        [Item(lot_id=lot_id, url=url) for lot_id, url in lot_info.items()],
+        ignore_conflicts=True,
+    )
+    return len(lot_info) - existing_count
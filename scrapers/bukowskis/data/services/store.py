@@ -0,0 +1,193 @@
+"""Pack-file store for the downloaded lot html.
+
+Lots are zstd-compressed and appended to pack files in data/lots_pack/. Every pack
+has an .idx file of fixed-size (lot_id, offset, length) records written after the
+lot itself, so a record in the index always points at a complete frame. Each
+process appends to packs of its own, which keeps the download pool free of locks.
+
+A dictionary trained on a sample of lots compresses the small, similar pages much
+better. Frames remember the id of the dictionary they were written with and every
+dictionary is kept as lots-<dict_id>.dict, so packs written before and after a
+(re)training stay readable. New lots are compressed with the newest dictionary:
+
+$ python -m data.services.store pack               # copy data/lots/*.html into packs
+$ python -m data.services.store train-dictionary   # train on packed lots
+"""
+import glob
+import os
+import struct
+import sys
+import time
+
+import zstandard
+from django.conf import settings
+
+INDEX_RECORD = struct.Struct("<qQI")
+PACK_SIZE = 1024 ** 3
+COMPRESSION_LEVEL = 10
+DICTIONARY_SIZE = 112 * 1024
+DICTIONARY_SAMPLES = 5000
+# Seconds between index refreshes on a membership miss, lots not in any pack miss every time
+REFRESH_INTERVAL = 5.0
+
+
+class LotStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.pid = os.getpid()
+        self.index = {}
+        self.index_size = {}
+        self.refreshed_at = 0.0
+        self.readers = {}
+        self.pack = None
+        self.pack_index = None
+
+        os.makedirs(path, exist_ok=True)
+        self.decompressors = {0: zstandard.ZstdDecompressor()}
+        self.load_dictionaries()
+
+    def dictionary_file(self, dict_id: int) -> str:
+        return os.path.join(self.path, f"lots-{dict_id}.dict")
+
+    def load_dictionaries(self) -> None:
+        """Add a decompressor for every trained dictionary and compress with the newest one
+
+        :return: None"""
+        files = sorted(glob.glob(os.path.join(self.path, "lots*.dict")), key=os.path.getmtime)
+        dictionary = None
+        for file in files:
+            with open(file, "rb") as f:
+                dictionary = zstandard.ZstdCompressionDict(f.read())
+            if dictionary.dict_id() not in self.decompressors:
+                self.decompressors[dictionary.dict_id()] = zstandard.ZstdDecompressor(dict_data=dictionary)
+        self.compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, dict_data=dictionary)
+
+    def refresh(self) -> None:
+        """Read index records appended since the last refresh, later records win"""
+        self.refreshed_at = time.monotonic()
+        for index_file in sorted(glob.glob(os.path.join(self.path, "*.idx"))):
+            # Only indexes that grew are read again
+            if os.path.getsize(index_file) <= self.index_size.get(index_file, 0):
+                continue
+            pack = index_file[:-len(".idx")] + ".pack"
+            with open(index_file, "rb") as f:
+                f.seek(self.index_size.get(index_file, 0))
+                data = f.read()
+            # Skip a record that is still being written
+            data = data[:len(data) - len(data) % INDEX_RECORD.size]
+            self.index_size[index_file] = self.index_size.get(index_file, 0) + len(data)
+            for lot_id, offset, length in INDEX_RECORD.iter_unpack(data):
+                self.index[lot_id] = (pack, offset, length)
+
+    def __contains__(self, lot_id: int) -> bool:
+        if lot_id not in self.index and time.monotonic() - self.refreshed_at >= REFRESH_INTERVAL:
+            self.refresh()
+        return lot_id in self.index
+
+    def read(self, lot_id: int) -> bytes:
+        """Read lot html
+
+        :param lot_id: int
+        :return: bytes"""
+        if lot_id not in self.index:
+            self.refresh()
+        if lot_id not in self.index:
+            raise KeyError(lot_id)
+
+        pack, offset, length = self.index[lot_id]
+        if pack not in self.readers:
+            self.readers[pack] = open(pack, "rb")
+        reader = self.readers[pack]
+        reader.seek(offset)
+        frame = reader.read(length)
+
+        dict_id = zstandard.get_frame_parameters(frame).dict_id
+        if dict_id not in self.decompressors:
+            # Trained by another process after this store was opened
+            self.load_dictionaries()
+        return self.decompressors[dict_id].decompress(frame)
+
+    def write(self, lot_id: int, contents: bytes) -> None:
+        """Append lot html to this process' pack
+
+        :param lot_id: int
+        :param contents: bytes
+        :return: None"""
+        if self.pack is None or self.pack.tell() >= PACK_SIZE:
+            self._open_pack()
+
+        frame = self.compressor.compress(contents)
+        offset = self.pack.tell()
+        self.pack.write(frame)
+        self.pack.flush()
+        # The index record goes last, so it never points at a half written frame
+        self.pack_index.write(INDEX_RECORD.pack(lot_id, offset, len(frame)))
+        self.pack_index.flush()
+        self.index_size[self.pack_index.name] += INDEX_RECORD.size
+        self.index[lot_id] = (self.pack.name, offset, len(frame))
+
+    def _open_pack(self) -> None:
+        self.close()
+        name = os.path.join(self.path, f"{time.time_ns()}-{os.getpid()}")
+        self.pack = open(f"{name}.pack", "ab")
+        self.pack_index = open(f"{name}.idx", "ab")
+        # Our own index records are added on write, refresh must not read them twice
+        self.index_size[f"{name}.idx"] = 0
+
+    def close(self) -> None:
+        for f in [self.pack, self.pack_index]:
+            if f is not None:
+                f.close()
+        self.pack = self.pack_index = None
+
+    def train_dictionary(self, samples: int = DICTIONARY_SAMPLES) -> str:
+        """Train a compression dictionary on packed lots, used for lots written afterwards
+
+        :param samples: int Lots to train on
+        :return: str Dictionary file"""
+        self.refresh()
+        lot_ids = sorted(self.index)[::max(1, len(self.index) // samples)]
+        dictionary = zstandard.train_dictionary(DICTIONARY_SIZE, [self.read(lot_id) for lot_id in lot_ids])
+        # Older dictionaries stay, frames compressed with them still need them
+        dictionary_file = self.dictionary_file(dictionary.dict_id())
+        with open(dictionary_file, "wb") as f:
+            f.write(dictionary.as_bytes())
+        self.load_dictionaries()
+        return dictionary_file
+
+
+_lot_store = None
+
+
+def get_lot_store() -> LotStore:
+    """Get the lot store of this process, opened on first use
+
+    :return: LotStore"""
+    global _lot_store
+    if _lot_store is None or _lot_store.pid != os.getpid():
+        # A forked worker opens its own store, so it never appends to the parent's pack
+        _lot_store = LotStore(os.path.join(settings.BASE_DIR, "data", "lots_pack"))
+    return _lot_store
+
+
+if __name__ == "__main__":
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    django.setup()
+
+    store = get_lot_store()
+    if sys.argv[1:] == ["pack"]:
+        store.refresh()
+        files = sorted(glob.glob(os.path.join(settings.BASE_DIR, "data", "lots", "*.html")))
+        for file in files:
+            lot_id = int(os.path.basename(file)[:-len(".html")])
+            if lot_id not in store.index:
+                with open(file, "rb") as f:
+                    store.write(lot_id, f.read())
+        store.close()
+        print(f"Packed {len(files)} lot files into {store.path}.")
+    elif sys.argv[1:] == ["train-dictionary"]:
+        print(f"Saved dictionary to {store.train_dictionary()}.")
+    else:
+        print(__doc__)
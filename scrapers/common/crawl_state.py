@@ -0,0 +1,83 @@
+"""Crawl state of the paginated search stages.
+
+Every (source, letter, page) of a search gets a row that is pending until the page
+is saved, then done, or failed when the site did not answer with the page or sent
+it without results. A restart fetches exactly the pages that are not done, and the
+progress stats are read from this table instead of counting the scraped rows.
+
+The first page of a search is always fetched again, pages added since the last
+run are planned against its live total.
+
+Each scraper subclasses CrawlPageBase in its own app, so the rows live in its
+database.
+"""
+from django.db import models
+from django.db.models import Count
+from django.utils import timezone
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+class CrawlPageBase(models.Model):
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    source = models.CharField(max_length=32)
+    letter = models.CharField(max_length=16)
+    page = models.IntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+        constraints = [
+            models.UniqueConstraint(fields=["source", "letter", "page"], name="%(app_label)s_%(class)s_unique_page"),
+        ]
+        indexes = [
+            models.Index(fields=["source", "letter", "status"], name="%(app_label)s_%(class)s_status"),
+        ]
+
+    def __str__(self):
+        return f"{self.source} {self.letter!r} page {self.page}: {self.status}"
+
+
+def plan_pages(model, source: str, letter: str, total_pages: int) -> list:
+    """Record the pages of a search and get the ones still to fetch
+
+    :param model: CrawlPageBase subclass
+    :param total_pages: int Pages the search has now
+    :return: list Page numbers that are pending or failed"""
+    model.objects.bulk_create(
+        [model(source=source, letter=letter, page=page) for page in range(1, total_pages + 1)],
+        ignore_conflicts=True,
+        batch_size=1000,
+    )
+    return list(
+        model.objects.filter(source=source, letter=letter, page__lte=total_pages)
+        .exclude(status=DONE)
+        .order_by("page")
+        .values_list("page", flat=True)
+    )
+
+
+def mark_pages(model, source: str, letter: str, pages: list, status: str) -> None:
+    # QuerySet.update skips auto_now, so the timestamp is set here
+    model.objects.filter(source=source, letter=letter, page__in=pages).update(
+        status=status, updated_at=timezone.now()
+    )
+
+
+def letter_stats(model, source: str, letter: str) -> dict:
+    """Count the pages of a search by status
+
+    :return: dict status -> pages"""
+    stats = {status: 0 for status, _ in CrawlPageBase.STATUS_CHOICES}
+    rows = model.objects.filter(source=source, letter=letter).values("status").annotate(pages=Count("id"))
+    stats.update({row["status"]: row["pages"] for row in rows})
+    return stats
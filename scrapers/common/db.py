@@ -0,0 +1,129 @@
+import time
+from multiprocessing import Pool
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+
+def iterate_in_chunks(queryset, chunk_size: int = 1000):
+    """Iterate a QuerySet in primary key order, one fully fetched chunk at a time
+
+    Unlike .iterator(), no cursor stays open between chunks, so other threads can
+    write to the same SQLite database while the rows are consumed."""
+    last_pk = None
+    queryset = queryset.order_by("pk")
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield from chunk
+        last_pk = chunk[-1].pk
+
+
+def iterate_key_ranges(queryset, key: str = "pk", chunk_size: int = 1000):
+    """Split a QuerySet into ranges of a unique field, reading only that field
+
+    :param key: str Unique field to split on
+    :return: generator of tuples (first, last) covering chunk_size rows each"""
+    last = None
+    keys = queryset.order_by(key).values_list(key, flat=True)
+    while True:
+        chunk = keys if last is None else keys.filter(**{f"{key}__gt": last})
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk[0], chunk[-1]
+        last = chunk[-1]
+
+
+_worker_queryset = None
+_worker_func = None
+_worker_key = None
+
+
+def _init_worker(queryset, func, key):
+    # The parent closed its connections before forking, so the first query of this
+    # worker opens its own connection, which it keeps for every range it runs
+    global _worker_queryset, _worker_func, _worker_key
+    _worker_queryset, _worker_func, _worker_key = queryset, func, key
+
+
+def _run_range(key_range):
+    low, high = key_range
+    rows = _worker_queryset.filter(**{f"{_worker_key}__gte": low, f"{_worker_key}__lte": high}).order_by(_worker_key)
+    return [_worker_func(row) for row in rows]
+
+
+def map_in_workers(queryset, func, processes: int, chunk_size: int = 100, key: str = "pk", ordered: bool = False):
+    """Apply func to every row of a QuerySet in a pool of worker processes
+
+    Only (first, last) key ranges are sent to the workers, each worker loads the
+    rows of a range itself with one query over its own connection. Nothing is
+    pickled but the ranges and func's results, and the parent never holds the rows.
+
+    :param func: Module level function called with each row in a worker
+    :param key: str Unique field the rows are ranged and ordered by
+    :param ordered: bool Yield results in key order, else as soon as a range is done
+    :return: generator of func results"""
+    ranges = iterate_key_ranges(queryset, key, chunk_size)
+    # Forked workers must not inherit an open connection
+    connections.close_all()
+    with Pool(processes, initializer=_init_worker, initargs=(queryset, func, key)) as p:
+        results = p.imap(_run_range, ranges) if ordered else p.imap_unordered(_run_range, ranges)
+        for chunk in results:
+            yield from chunk
+        # Let the workers exit on their own, a terminated worker can die halfway through a queue put
+        p.close()
+        p.join()
+
+
+class BulkUpdater:
+    """Single writer that saves model instances with one bulk_update per batch
+
+    Every batch is written inside one transaction, instead of one transaction per
+    instance, and the writer keeps count of the rows per second it sustains."""
+
+    def __init__(self, model, fields: list, batch_size: int = 500):
+        self.model = model
+        # bulk_update skips auto_now, those fields are stamped on flush
+        self.auto_now = [
+            field.name for field in model._meta.concrete_fields
+            if getattr(field, "auto_now", False) and field.name not in fields
+        ]
+        self.fields = fields + self.auto_now
+        self.batch_size = batch_size
+        self.pending = []
+        self.written = 0
+        self.started = time.monotonic()
+
+    def add(self, instance) -> None:
+        self.pending.append(instance)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+
+        now = timezone.now()
+        for instance in self.pending:
+            for name in self.auto_now:
+                setattr(instance, name, now)
+        with transaction.atomic():
+            self.model.objects.bulk_update(self.pending, self.fields)
+        self.written += len(self.pending)
+        self.pending = []
+
+    @property
+    def rate(self) -> float:
+        return self.written / max(time.monotonic() - self.started, 1e-9)
+
+    def __str__(self) -> str:
+        return f"{self.written} {self.model._meta.verbose_name_plural} saved, {self.rate:.1f}/s"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
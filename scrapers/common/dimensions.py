@@ -0,0 +1,143 @@
+"""Sizes of art works parsed from the dimension strings of the auction sites.
+
+Regex passes over a whole column turn strings like
+
+    7.28 x 4.72 in
+    1.4 cm - 93.8 cm (0.55 in - 36.93 in)
+    40 x 50 cm, 40x50x3 cm, 40,5 × 50 cm, 400 x 500 mm, 12"
+
+into width, height and depth in centimeters, and their area in square centimeters.
+Every side is converted on its own. A side without a unit takes the unit written
+after the next side, ex. "40 x 50 cm", else the unit of the side before it, ex.
+"40 cm x 50", else default_unit. A repeat of the size in other units, in
+parentheses, is ignored. Numbers before the size, ex. "Signed 1923, 40 x 50 cm"
+or "Lot 12 - 40 x 50 cm", are skipped, see DIMENSIONS_PATTERNS.
+
+Used by the scrapers (import as common.dimensions) and by the offline scripts
+of the repository root (import as scrapers.common.dimensions).
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+UNITS = {"mm": 0.1, "cm": 1.0, "m": 100.0, "in": 2.54}
+AREA_UNITS = {"mm2": 1e-6, "cm2": 1e-4, "m2": 1.0}
+
+SIDES = ["width", "height", "depth"]
+
+
+def _side(name: str, unit: str = "?") -> str:
+    # unit "?" makes the unit optional, "" requires it
+    return rf"(?P<{name}>\d+(?:\.\d+)?)(?:\s*(?P<{name}_unit>mm|cm|in|m)\b){unit}"
+
+
+def _sides(first_unit: str, second_unit: str, separator: str) -> str:
+    return (
+        _side("width", first_unit) + separator + _side("height", second_unit)
+        + "(?:" + separator + _side("depth") + ")?"
+    )
+
+
+_TIMES = r"\s*(?:x|\*|by)\s*"
+_DASH = r"\s*-\s*"
+# RE2 syntax, pyarrow runs them over the whole column in native code. Tried in order,
+# each on the strings the previous ones did not match:
+# - sides joined by x, ex. "40 x 50 cm", so a lot number or a year before the size is skipped
+# - sides joined by a dash when one of them has a unit, ex. "1.4 cm - 93.8 cm", a
+#   year range like "1998-2000" has none
+# - a lone side with a unit, ex. 12"
+DIMENSIONS_PATTERNS = [
+    _sides("?", "?", _TIMES),
+    _sides("", "?", _DASH),
+    _sides("?", "", _DASH),
+    _side("width", ""),
+]
+
+
+def normalize_dimensions(column: pd.Series) -> pa.Array:
+    text = pa.array(column.to_numpy(dtype=object), pa.string(), from_pandas=True)
+    text = pc.utf8_lower(text)
+    text = pc.replace_substring_regex(text, r"\([^)]*\)", " ")
+    # Grouping commas, ex. 1,200 or 1,200,000, then decimal commas, ex. 40,5
+    for _ in range(2):
+        text = pc.replace_substring_regex(text, r"(\d),(\d{3})(\D|$)", r"\1\2\3")
+    text = pc.replace_substring_regex(text, r"(\d),(\d{1,2})(\D|$)", r"\1.\2\3")
+    text = pc.replace_substring(pc.replace_substring(text, "×", "x"), '"', " in")
+    return pc.replace_substring_regex(text, r"\binch(es)?\b", "in")
+
+
+def _extract(text: pa.Array, pattern: str) -> tuple:
+    """Match the pattern in every string
+
+    :return: tuple (sides, unit factors), n x 3 float arrays with NaN where missing"""
+    parts = pc.extract_regex(text, pattern)
+    # flatten() keeps the rows without a match null in every field
+    fields = dict(zip([field.name for field in parts.type], parts.flatten()))
+    missing = np.full(len(text), np.nan)
+    sides = np.column_stack([_to_float(fields[side]) if side in fields else missing for side in SIDES])
+    factors = np.column_stack([
+        _to_factor(fields[f"{side}_unit"]) if side in fields else missing for side in SIDES
+    ])
+    return sides, factors
+
+
+def _to_float(strings: pa.Array) -> np.ndarray:
+    # Groups that did not take part in the match are empty strings
+    strings = pc.if_else(pc.equal(strings, ""), pa.scalar(None, pa.string()), strings)
+    return pc.cast(strings, pa.float64()).to_numpy(zero_copy_only=False)
+
+
+def _to_factor(units: pa.Array) -> np.ndarray:
+    index = pc.index_in(units, value_set=pa.array(list(UNITS)))
+    return pa.array(list(UNITS.values()), pa.float64()).take(index).to_numpy(zero_copy_only=False)
+
+
+def parse_dimensions(column: pd.Series, default_unit: str = "cm") -> pd.DataFrame:
+    """Parse a column of dimension strings
+
+    :param column: Series of str, None for unknown
+    :param default_unit: str Unit of sizes written without one, a key of UNITS
+    :return: DataFrame with width_cm, height_cm, depth_cm and area_cm2 columns, NaN where unknown"""
+    text = normalize_dimensions(column)
+    sides, factors = _extract(text, DIMENSIONS_PATTERNS[0])
+    for pattern in DIMENSIONS_PATTERNS[1:]:
+        rest = np.flatnonzero(np.isnan(sides[:, 0]))
+        if not len(rest):
+            break
+        sides[rest], factors[rest] = _extract(text.take(rest), pattern)
+
+    # A side without a unit takes the unit of the next side, right to left, then of the side before it
+    for side in [1, 0]:
+        factors[:, side] = np.where(np.isnan(factors[:, side]), factors[:, side + 1], factors[:, side])
+    for side in [1, 2]:
+        factors[:, side] = np.where(np.isnan(factors[:, side]), factors[:, side - 1], factors[:, side])
+    factors = np.where(np.isnan(factors), UNITS[default_unit], factors)
+
+    sizes = sides * factors
+    return pd.DataFrame(
+        {
+            "width_cm": sizes[:, 0],
+            "height_cm": sizes[:, 1],
+            "depth_cm": sizes[:, 2],
+            # A single side has no area
+            "area_cm2": sizes[:, 0] * sizes[:, 1],
+        },
+        index=column.index,
+    )
+
+
+def parse_area(dimensions: str, default_unit: str = "cm"):
+    """Area of a single dimension string, see parse_dimensions for whole columns
+
+    :return: float cm2 or None"""
+    area = parse_dimensions(pd.Series([dimensions], dtype=object), default_unit)["area_cm2"].iloc[0]
+    return None if np.isnan(area) else float(area)
+
+
+def to_square_meters(area: pd.Series, unit: str) -> pd.Series:
+    """Convert an area column to m2
+
+    :param unit: str Unit the column is in, a key of AREA_UNITS
+    :return: Series"""
+    return area * AREA_UNITS[unit]
@@ -0,0 +1,298 @@
+import asyncio
+import queue
+import random
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from common.http_cache import ResponseCache, get_cache
+
+Response = namedtuple("Response", ["url", "status", "headers", "text"])
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class HostRateLimiter:
+    """Spaces out request starts so no host gets more than `rate` requests per second"""
+
+    def __init__(self, rate: float = None):
+        self.rate = rate
+        self._next_start = {}
+        self._locks = {}
+
+    async def wait(self, url: str) -> None:
+        if not self.rate:
+            return
+
+        host = urlsplit(url).netloc
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            now = time.monotonic()
+            start = max(now, self._next_start.get(host, now))
+            self._next_start[host] = start + 1 / self.rate
+        await asyncio.sleep(start - now)
+
+
+class AdaptiveConcurrency:
+    """AIMD controller for the number of requests in flight.
+
+    Every good response raises the limit by 1/limit, about one more request per round
+    trip. An error, an empty page or a latency above LATENCY_TOLERANCE times the best
+    latency seen halves it, at most once per round trip."""
+
+    LATENCY_TOLERANCE = 2.0
+    # Latencies to see before judging them
+    WARMUP = 20
+    # Seconds of history behind throughput and error_rate
+    WINDOW = 10
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = None):
+        self.minimum = minimum
+        self.maximum = max(maximum or initial, initial)
+        self.limit = float(initial)
+        self.in_flight = 0
+        self.latency = None
+        self.best_latency = None
+        self._samples = 0
+        self._decreased_at = 0
+        self._responses = deque()
+        self._errors = deque()
+        self._condition = None
+
+    def start(self) -> None:
+        # Every Fetcher.map runs its own event loop, the condition belongs to it
+        self._condition = asyncio.Condition()
+        self.in_flight = 0
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def record(self, latency: float, error: bool = False) -> None:
+        """Adjust the limit after a response
+
+        :param latency: float Seconds
+        :param error: bool 429/5xx or connection error"""
+        now = time.monotonic()
+        self._responses.append(now)
+        if error:
+            self._errors.append(now)
+        for times in [self._responses, self._errors]:
+            while times and times[0] < now - self.WINDOW:
+                times.popleft()
+
+        if not error:
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            # The baseline creeps up slowly, so a site that got slower for good is not punished forever
+            self.best_latency = min((self.best_latency or self.latency) * 1.005, self.latency)
+            self._samples += 1
+
+        overloaded = self._samples >= self.WARMUP and self.latency > self.best_latency * self.LATENCY_TOLERANCE
+        if error or overloaded:
+            self._decrease(now)
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def record_empty(self) -> None:
+        # The page was already counted as a response, only its emptiness is news
+        now = time.monotonic()
+        self._errors.append(now)
+        self._decrease(now)
+
+    def _decrease(self, now: float) -> None:
+        if now - self._decreased_at > (self.latency or 1):
+            self.limit = max(self.minimum, self.limit / 2)
+            self._decreased_at = now
+
+    @property
+    def concurrency(self) -> int:
+        return int(self.limit)
+
+    @property
+    def throughput(self) -> float:
+        """Responses per second over the last WINDOW seconds"""
+        if len(self._responses) < 2:
+            return 0.0
+        return len(self._responses) / max(time.monotonic() - self._responses[0], 1e-3)
+
+    @property
+    def error_rate(self) -> float:
+        return len(self._errors) / len(self._responses) if self._responses else 0.0
+
+    def __str__(self) -> str:
+        return (f"concurrency {self.concurrency}/{self.maximum}, {self.throughput:.1f} req/s, "
+                f"{self.error_rate:.0%} errors")
+
+
+def backoff(attempt: int, retry_after: str = None) -> float:
+    """Seconds to wait before a retry, full jitter unless the site sent Retry-After"""
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return random.uniform(0, 2 ** attempt)
+
+
+class Fetcher:
+    """Asyncio fetch engine sharing one keep-alive connection pool between all requests.
+
+    The requests in flight start at `concurrency` and are adjusted between 1 and
+    `max_concurrency` by an AdaptiveConcurrency controller, while each host gets at most
+    `rate` requests per second. Pages are parsed by a callback on the event loop, while the
+    results are handed back to the calling thread, so database writes stay synchronous.
+    Responses go through the shared on-disk cache unless HTTP_CACHE_DISABLED=1, with the
+    short listing TTL when `listing` is set."""
+
+    def __init__(self, concurrency: int = 20, rate: float = None, headers: dict = None,
+                 cookies: dict = None, timeout: int = 30, retries: int = 3, cache: ResponseCache = None,
+                 max_concurrency: int = None, listing: bool = False):
+        self.controller = AdaptiveConcurrency(concurrency, maximum=max_concurrency)
+        self.concurrency = self.controller.maximum
+        self.cache = cache or get_cache()
+        self.limiter = HostRateLimiter(rate)
+        self.headers = headers
+        self.cookies = cookies
+        self.timeout = timeout
+        self.retries = retries
+        self.listing = listing
+
+    def map(self, jobs, parse, is_empty=None):
+        """Fetch every (url, context) job and yield parse(response, context) as pages complete
+
+        :param jobs: iterable of (url, context), consumed lazily
+        :param parse: callable(Response, context), runs on the event loop thread
+        :param is_empty: callable(parse result), True for a page the site served without its
+            contents, which slows the fetcher down like an error does
+        :return: generator of parse results in completion order"""
+        results = queue.Queue(maxsize=self.concurrency * 2)
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=asyncio.run, args=(self._run(iter(jobs), parse, is_empty, results, stop),), daemon=True
+        )
+        thread.start()
+
+        try:
+            while True:
+                item = results.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            # Leaving the loop early cancels the requests that are still in flight
+            stop.set()
+            while thread.is_alive():
+                try:
+                    results.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            thread.join()
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str) -> Response:
+        entry = self.cache.get(url) if self.cache else None
+        if entry and self.cache.is_fresh(entry, self.listing):
+            return self._cached_response(entry)
+        if self.cache:
+            self.cache.check_offline(url, entry)
+        validators = self.cache.validators(entry) if entry else None
+
+        for attempt in range(self.retries + 1):
+            await self.limiter.wait(url)
+            await self.controller.acquire()
+            started = time.monotonic()
+            retry_after = None
+            try:
+                async with session.get(url, headers=validators) as resp:
+                    if resp.status == 304 and entry:
+                        self.controller.record(time.monotonic() - started)
+                        headers = {**entry["headers"], **resp.headers}
+                        self.cache.put(url, entry["status"], headers, entry["content"], entry["encoding"])
+                        return self._cached_response(entry)
+
+                    text = await resp.text(errors="replace")
+                    failed = resp.status == 429 or resp.status >= 500
+                    self.controller.record(time.monotonic() - started, failed)
+                    if resp.status == 200 and self.cache:
+                        self.cache.put(url, resp.status, resp.headers, await resp.read(), resp.get_encoding())
+                    if not failed or attempt == self.retries:
+                        return Response(str(resp.url), resp.status, dict(resp.headers), text)
+                    retry_after = resp.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.controller.record(time.monotonic() - started, True)
+                if attempt == self.retries:
+                    raise
+            finally:
+                await self.controller.release()
+            await asyncio.sleep(backoff(attempt, retry_after))
+
+    @staticmethod
+    def _cached_response(entry: dict) -> Response:
+        text = entry["content"].decode(entry["encoding"] or "utf-8", errors="replace")
+        return Response(entry["url"], entry["status"], entry["headers"], text)
+
+    async def _run(self, jobs, parse, is_empty, results: queue.Queue, stop: threading.Event) -> None:
+        loop = asyncio.get_running_loop()
+        jobs_lock = asyncio.Lock()
+        # Jobs often come from a QuerySet, which Django only lets us evaluate outside the
+        # event loop and always on the same thread
+        jobs_thread = ThreadPoolExecutor(max_workers=1)
+
+        async def put(item):
+            # Block on a full queue in a thread, so a slow consumer slows down fetching
+            while not stop.is_set():
+                try:
+                    await loop.run_in_executor(None, results.put, item, True, 0.5)
+                    return
+                except queue.Full:
+                    continue
+
+        async def worker(session):
+            while not stop.is_set():
+                async with jobs_lock:
+                    job = await loop.run_in_executor(jobs_thread, next, jobs, None)
+                if job is None:
+                    return
+                url, context = job
+                response = await self.fetch(session, url)
+                result = parse(response, context)
+                if is_empty is not None and is_empty(result):
+                    self.controller.record_empty()
+                await put(result)
+
+        self.controller.start()
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                             headers=self.headers, cookies=self.cookies) as session:
+                workers = [asyncio.create_task(worker(session)) for _ in range(self.concurrency)]
+                try:
+                    while workers and not stop.is_set():
+                        done, pending = await asyncio.wait(workers, timeout=0.5,
+                                                           return_when=asyncio.FIRST_EXCEPTION)
+                        for task in done:
+                            task.result()
+                        workers = list(pending)
+                finally:
+                    for task in workers:
+                        task.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+                    jobs_thread.shutdown(wait=False)
+        except Exception as e:
+            await put(_Failure(e))
+            return
+        await put(_DONE)
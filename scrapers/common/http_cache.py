@@ -0,0 +1,213 @@
+"""On-disk cache of HTTP responses shared by the scrapers.
+
+Every 200 response is stored under HTTP_CACHE_DIR as one zlib-compressed file per
+url, with its status, headers and body. A cached response younger than
+HTTP_CACHE_TTL seconds is served without a request. An older one is revalidated
+with its ETag/Last-Modified, and a 304 answer keeps the cached body.
+
+Listing and search pages gain new lots all the time, they are fetched with
+listing=True and only kept for HTTP_CACHE_LISTING_TTL seconds. The long TTL is
+for lot pages, which do not change once the auction is over.
+
+Entries are evicted by age: once a day, the first process that opens the cache
+deletes the files not fetched or revalidated for HTTP_CACHE_MAX_AGE seconds, see
+ResponseCache.prune. `python -m common.http_cache`, run from scrapers/, prunes on
+demand.
+
+HTTP_CACHE_OFFLINE=1 serves every cached url regardless of its age and raises
+CacheMiss for a url that is not cached, so a stage can be replayed after a parser
+fix at disk speed without sending a single request, it never prunes.
+HTTP_CACHE_DISABLED=1 turns the cache off.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent.parent / ".http_cache"
+DEFAULT_TTL = 7 * 24 * 60 * 60
+DEFAULT_LISTING_TTL = 60 * 60
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+PRUNE_INTERVAL = 24 * 60 * 60
+PRUNE_MARKER = ".pruned"
+
+
+class CacheMiss(Exception):
+    """A url that is not cached was requested in offline mode"""
+
+
+class ResponseCache:
+    def __init__(self, path: str, ttl: float = DEFAULT_TTL, offline: bool = False,
+                 listing_ttl: float = DEFAULT_LISTING_TTL, max_age: float = DEFAULT_MAX_AGE):
+        self.path = path
+        self.ttl = ttl
+        self.listing_ttl = listing_ttl
+        self.offline = offline
+        self.max_age = max_age
+
+    def file(self, url: str) -> str:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, url: str):
+        """Get cached entry
+
+        :param url: str
+        :return: dict with url, status, headers, encoding, fetched_at and content, or None"""
+        try:
+            with open(self.file(url), "rb") as f:
+                data = zlib.decompress(f.read())
+        except (FileNotFoundError, zlib.error):
+            return None
+        meta, content = data.split(b"\n", 1)
+        entry = json.loads(meta)
+        entry["content"] = content
+        return entry
+
+    def put(self, url: str, status: int, headers: dict, content: bytes, encoding: str = None) -> None:
+        meta = {
+            "url": url,
+            "status": status,
+            "headers": dict(headers),
+            "encoding": encoding,
+            "fetched_at": time.time(),
+        }
+        file = self.file(url)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        # Write aside and rename, so parallel workers never read half an entry. mkstemp
+        # names the file uniquely across processes and the threads of one process
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", prefix=os.path.basename(file) + ".", dir=os.path.dirname(file))
+        with os.fdopen(fd, "wb") as f:
+            f.write(zlib.compress(json.dumps(meta).encode("utf-8") + b"\n" + content))
+        os.replace(tmp, file)
+
+    def is_fresh(self, entry: dict, listing: bool = False) -> bool:
+        ttl = self.listing_ttl if listing else self.ttl
+        return self.offline or time.time() - entry["fetched_at"] < ttl
+
+    def check_offline(self, url: str, entry: dict) -> None:
+        if self.offline and entry is None:
+            raise CacheMiss(url)
+
+    def prune(self) -> int:
+        """Delete the entries not fetched or revalidated for max_age seconds, and the
+        temp files of killed workers as old as that
+
+        :return: int Number of deleted files"""
+        deleted = 0
+        cutoff = time.time() - self.max_age
+        for directory, _, files in os.walk(self.path):
+            for name in files:
+                if name == PRUNE_MARKER:
+                    continue
+                file = os.path.join(directory, name)
+                try:
+                    # put() rewrites the file on every fetch and 304, its mtime is the last use
+                    if os.stat(file).st_mtime < cutoff:
+                        os.remove(file)
+                        deleted += 1
+                except FileNotFoundError:
+                    # Replaced or pruned by another worker meanwhile
+                    pass
+        return deleted
+
+    def prune_if_due(self) -> None:
+        if self.offline:
+            return
+        marker = Path(self.path) / PRUNE_MARKER
+        try:
+            if time.time() - marker.stat().st_mtime < PRUNE_INTERVAL:
+                return
+        except FileNotFoundError:
+            pass
+        # Touched first, so the other workers starting now skip it
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+        self.prune()
+
+    @staticmethod
+    def validators(entry: dict) -> dict:
+        """Get conditional request headers for a stale entry
+
+        :return: dict"""
+        headers = CaseInsensitiveDict(entry["headers"])
+        validators = {}
+        if "ETag" in headers:
+            validators["If-None-Match"] = headers["ETag"]
+        if "Last-Modified" in headers:
+            validators["If-Modified-Since"] = headers["Last-Modified"]
+        return validators
+
+
+_cache = None
+
+
+def get_cache():
+    """Get the response cache configured by the HTTP_CACHE_* environment variables
+
+    :return: ResponseCache or None when disabled"""
+    global _cache
+    if os.getenv("HTTP_CACHE_DISABLED") == "1":
+        return None
+    if _cache is None:
+        _cache = ResponseCache(
+            os.getenv("HTTP_CACHE_DIR") or str(DEFAULT_CACHE_DIR),
+            ttl=float(os.getenv("HTTP_CACHE_TTL") or DEFAULT_TTL),
+            offline=os.getenv("HTTP_CACHE_OFFLINE") == "1",
+            listing_ttl=float(os.getenv("HTTP_CACHE_LISTING_TTL") or DEFAULT_LISTING_TTL),
+            max_age=float(os.getenv("HTTP_CACHE_MAX_AGE") or DEFAULT_MAX_AGE),
+        )
+        _cache.prune_if_due()
+    return _cache
+
+
+def to_response(entry: dict) -> requests.Response:
+    response = requests.Response()
+    response.url = entry["url"]
+    response.status_code = entry["status"]
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    response.encoding = entry["encoding"]
+    response._content = entry["content"]
+    return response
+
+
+def cached_get(url: str, headers: dict = None, session: requests.Session = None, listing: bool = False,
+               store: bool = True, **kwargs) -> requests.Response:
+    """requests.get that goes through the response cache
+
+    :param url: str
+    :param headers: dict
+    :param session: Session whose connection pool to use, a new connection per request without it
+    :param listing: bool A listing or search page, cached for the short listing TTL only
+    :param store: bool False for pages the caller keeps itself, they are neither read from nor
+        written to the cache, offline mode still sends no request for them
+    :return: Response"""
+    http = session or requests
+    cache = get_cache()
+    if cache is None:
+        return http.get(url, headers=headers, **kwargs)
+
+    entry = cache.get(url) if store else None
+    if entry and cache.is_fresh(entry, listing):
+        return to_response(entry)
+    cache.check_offline(url, entry)
+
+    headers = {**(headers or {}), **(cache.validators(entry) if entry else {})}
+    response = http.get(url, headers=headers, **kwargs)
+    if response.status_code == 304 and entry:
+        cache.put(url, entry["status"], {**entry["headers"], **response.headers}, entry["content"], entry["encoding"])
+        return to_response(entry)
+    if response.status_code == 200 and store:
+        cache.put(url, response.status_code, response.headers, response.content, response.encoding)
+    return response
+
+
+if __name__ == "__main__":
+    cache = get_cache()
+    print(f"Deleted {cache.prune()} files from {cache.path}." if cache else "The cache is disabled.")
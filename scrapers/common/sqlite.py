@@ -0,0 +1,28 @@
+"""SQLite connection settings shared by the scrapers.
+
+WAL lets readers work while a writer commits, and synchronous=NORMAL only syncs
+the log at checkpoints, which is safe in WAL mode. Write transactions start with
+BEGIN IMMEDIATE, so a second writer waits for the lock up front instead of
+failing when its read lock would have to be upgraded.
+"""
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    # 64 MiB page cache, 256 MiB memory map
+    "cache_size": -64 * 1024,
+    "mmap_size": 256 * 1024 * 1024,
+}
+
+
+def sqlite_options(timeout: float = 30) -> dict:
+    """Get DATABASES OPTIONS for a scraper database
+
+    :param timeout: float Seconds to wait for a lock before "database is locked"
+    :return: dict"""
+    return {
+        "timeout": timeout,
+        "transaction_mode": "IMMEDIATE",
+        "init_command": ";".join(f"PRAGMA {name}={value}" for name, value in PRAGMAS.items()),
+    }
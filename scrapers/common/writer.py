@@ -0,0 +1,135 @@
+"""Single database writer for the process pools.
+
+Pool workers used to write to the SQLite file themselves, and every commit had to
+wait for the lock held by the others. With a DbWriter running, the workers put
+their writes on a queue instead and go back to fetching. One writer process
+takes them off in batches and commits each batch in one transaction, so the
+number of commits follows the batch size instead of the number of workers.
+
+A write is a module level function and its arguments, both sent over the queue,
+so they are kept to plain data like primary keys and field dicts:
+
+    with DbWriter():
+        with Pool(20) as p:   # forked after the writer, workers inherit its queue
+            ...               # submit(save_lot, lot_id, rows) in the workers
+
+Without a running writer, submit() runs the write in the calling process.
+"""
+import multiprocessing
+import queue
+import time
+import traceback
+
+from django.db import connections, transaction
+
+_writer = None
+
+
+class DbWriter:
+    def __init__(self, batch_size: int = 500, max_delay: float = 1.0, max_pending: int = 10000):
+        """
+        :param batch_size: int Writes committed in one transaction
+        :param max_delay: float Seconds a write waits for its batch to fill up
+        :param max_pending: int Queued writes before submit() blocks, so a slow disk slows the workers down
+        """
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.queue = multiprocessing.Queue(max_pending)
+        self.written = multiprocessing.Value("q", 0)
+        self.failed = multiprocessing.Value("q", 0)
+        self.process = None
+
+    def start(self) -> "DbWriter":
+        global _writer
+        # The writer opens its own connection instead of sharing ours
+        connections.close_all()
+        self.process = multiprocessing.Process(target=self._run, name="db-writer", daemon=True)
+        self.process.start()
+        _writer = self
+        return self
+
+    def submit(self, func, *args) -> None:
+        self.queue.put((func, args))
+
+    def close(self) -> None:
+        """Wait until every submitted write is committed"""
+        global _writer
+        if self.process is not None:
+            self.queue.put(None)
+            self.process.join()
+            self.process = None
+        if _writer is self:
+            _writer = None
+
+    def _next_batch(self) -> tuple:
+        """Take the next writes off the queue
+
+        :return: tuple (list of writes, whether the writer was closed)"""
+        first = self.queue.get()
+        if first is None:
+            return [], True
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            try:
+                write = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if write is None:
+                return batch, True
+            batch.append(write)
+        return batch, False
+
+    def _run(self) -> None:
+        closed = False
+        while not closed:
+            batch, closed = self._next_batch()
+            if not batch:
+                continue
+
+            try:
+                with transaction.atomic():
+                    for func, args in batch:
+                        func(*args)
+            except Exception:
+                # One bad write must not lose the batch, write them one by one
+                for func, args in batch:
+                    self._write_one(func, args)
+            else:
+                with self.written.get_lock():
+                    self.written.value += len(batch)
+        connections.close_all()
+
+    def _write_one(self, func, args) -> None:
+        try:
+            with transaction.atomic():
+                func(*args)
+        except Exception:
+            traceback.print_exc()
+            with self.failed.get_lock():
+                self.failed.value += 1
+        else:
+            with self.written.get_lock():
+                self.written.value += 1
+
+    def __str__(self) -> str:
+        return f"{self.written.value} writes committed, {self.failed.value} failed"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def submit(func, *args) -> None:
+    """Write through the running DbWriter, or right here without one
+
+    :param func: Module level function doing the write
+    :return: None"""
+    if _writer is not None:
+        _writer.submit(func, *args)
+    else:
+        with transaction.atomic():
+            func(*args)
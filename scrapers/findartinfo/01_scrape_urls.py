@@ -15,10 +15,15 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 import django
 django.setup()
 
-from lots.models import Lot
+from django.db import connections, transaction
+
+from lots.models import Lot, CrawlPage
 from core.telegram import log
+from common.crawl_state import DONE, FAILED, letter_stats, mark_pages, plan_pages
+from common.http_cache import cached_get
 
 
+SOURCE = "findartinfo"
 DEFAULT_SEARCH_URL = "http://www.findartinfo.com/english/Artists/Result?artistName={key}"
 DEFAULT_SEARCH_PAGE_URL = "http://www.findartinfo.com/english/Artists/Result?artistName={key}&pageIndex={page}"
 
@@ -29,46 +34,65 @@ PAGE_INFO_XPATH = '//h2'
 LOT_ROW_XPATH = '//tr[contains(@onmouseout, "Mouse")]'
 
 
-def save_page(*args):
+def scrape_page(*args):
+    """Fetch a search page and parse its lot rows, runs in the pool workers
+
+    :return: tuple (page_num, key, status code, list of Lot field dicts, skipped rows count)"""
     page_num, key = args[0][0], args[0][1]
     url = DEFAULT_SEARCH_PAGE_URL.format(key=key, page=page_num)
-    resp = requests.get(url)
+    resp = cached_get(url, listing=True)
     soup = bs4.BeautifulSoup(resp.text, 'lxml')
     lots = soup.findAll("tr", {"onmouseout": "MouseMove(this,'out')"})
 
+    rows = []
+    skipped = 0
     for lot in lots:
         urls = lot.findAll("a")
         try:
-            Lot.objects.create(
+            row = dict(
                 url=urls[0].get("href"),
                 letter=key,
                 page=page_num,
-                hammer_amount=urls[1].text,
-                photo_amount=urls[2].text,
-                sign_amount=urls[3].text,
+                hammer_amount=int(urls[1].text),
+                photo_amount=int(urls[2].text),
+                sign_amount=int(urls[3].text),
                 hammer_url=urls[1].get("href"),
                 photo_url=urls[2].get("href"),
                 sign_url=urls[3].get("href"),
             )
+        except (IndexError, ValueError):
+            skipped += 1
+            continue
 
-        except Exception as e:
+        if None in (row["url"], row["hammer_url"], row["photo_url"], row["sign_url"]):
+            skipped += 1
             continue
+        rows.append(row)
 
+    return page_num, key, resp.status_code, rows, skipped
 
-trans = str.maketrans(string.ascii_lowercase, string.ascii_lowercase[1:] + "a")
 
-if __name__ == "__main__":
-    for letter in string.ascii_lowercase:
-        next_letter = letter.translate(trans)
+@transaction.atomic
+def save_page(page_num, key, status, rows, skipped) -> tuple:
+    """Save the lots of a page and its crawl state in one transaction, runs in the main process only
 
-        # If lots with next letter more than 5000, then skip
-        if Lot.objects.filter(letter=next_letter).count() > 5000 and next_letter != "a":
-            log(f"Skipping letter: {letter}, because {next_letter!r} exists")
-            continue
+    :return: tuple (inserted, duplicates)"""
+    urls = {row["url"] for row in rows}
+    existing = Lot.objects.filter(url__in=urls).count()
+    Lot.objects.bulk_create([Lot(**row) for row in rows], ignore_conflicts=True)
+    # A page without lot rows is a soft block or an error page, retried on the next run
+    found = rows or skipped
+    mark_pages(CrawlPage, SOURCE, key, [page_num], DONE if status == 200 and found else FAILED)
+    inserted = len(urls) - existing
+    return inserted, len(rows) - inserted
 
+
+if __name__ == "__main__":
+    for letter in string.ascii_lowercase:
         log(f"Scraping letter: {letter}")
 
-        response = requests.get(DEFAULT_SEARCH_URL.format(key=letter))
+        # The live total, a letter whose pages are all done can have gained new ones
+        response = cached_get(DEFAULT_SEARCH_URL.format(key=letter), listing=True)
         tree = etree.HTML(response.text)
         page_info = tree.xpath(PAGE_INFO_XPATH)[0].text.strip().replace(",", "")
 
@@ -76,17 +100,27 @@ if __name__ == "__main__":
         total_results = int(total_results)
         total_pages = int(total_pages)
 
-        lot_amount = Lot.objects.filter(letter=letter).count()
-
-        # If lot amount is greater than total results by 95% or more, skip
-        if lot_amount > total_results * 0.95:
-            log(f"Skipping letter: {letter}, because lot amount is greater than total results by 95% or more")
+        # Only the pages that are not saved yet, failed ones are retried
+        pages = plan_pages(CrawlPage, SOURCE, letter, total_pages)
+        log(f"Total pages: {total_pages}, pages to fetch: {len(pages)}")
+        if not pages:
             continue
 
-        # Get the latest page
-        latest_page = lot_amount // 30 + 1
-
-        gen_args = [(page, letter) for page in range(latest_page, total_pages + 1)]
+        gen_args = [(page, letter) for page in pages]
 
+        # Workers only fetch and parse, this process is the single writer.
+        # Forked workers open their own connections instead of sharing ours
+        connections.close_all()
+        totals = {"inserted": 0, "duplicates": 0, "skipped": 0}
         with Pool(40) as p:
-            list(tqdm(p.imap(save_page, gen_args), total=total_pages - latest_page + 1))
+            progress = tqdm(p.imap_unordered(scrape_page, gen_args), total=len(pages))
+            for page, key, status, rows, skipped in progress:
+                inserted, duplicates = save_page(page, key, status, rows, skipped)
+                totals["inserted"] += inserted
+                totals["duplicates"] += duplicates
+                totals["skipped"] += skipped
+                progress.set_postfix(page=page, inserted=inserted, duplicates=duplicates, total_inserted=totals["inserted"])
+
+        stats = letter_stats(CrawlPage, SOURCE, letter)
+        log(f"Letter {letter}: {stats[DONE]} pages done, {stats[FAILED]} failed. "
+            f"Lots inserted: {totals['inserted']}, duplicates: {totals['duplicates']}, unparsed rows: {totals['skipped']}")
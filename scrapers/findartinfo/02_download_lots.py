@@ -1,8 +1,9 @@
 import os
 import re
 import uuid
-from multiprocessing import Pool
-from urllib.parse import urljoin
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
 
 import requests
 import bs4
@@ -10,7 +11,6 @@ import lxml
 import string
 import dotenv
 
-from django.db import transaction
 from lxml import etree
 # from tqdm.contrib.telegram import tqdm
 from tqdm import tqdm
@@ -24,90 +24,177 @@ django.setup()
 
 from lots.models import Lot, Item
 from core.telegram import log
+from common.db import map_in_workers
+from common.http_cache import cached_get
+from common.writer import DbWriter, submit
 
 
 BASE_URL = "http://www.findartinfo.com"
 
+# Pages of one lot fetched at once by each process
+PAGE_THREADS = int(os.getenv("FINDARTINFO_PAGE_THREADS") or 4)
+# Lots loaded by a process with one query
+LOTS_PER_TASK = int(os.getenv("FINDARTINFO_LOTS_PER_TASK") or 20)
 
-def download_lot(lot):
-    if lot.has_lot_downloaded:
-        return
+LOT_TABLE_XPATH = etree.XPath('//table[@id="table5"]')
+AUTHOR_XPATH = etree.XPath('.//h1[contains(concat(" ", normalize-space(@class), " "), " underline ")]')
+TABLE_XPATH = etree.XPath('.//table')
+ROW_XPATH = etree.XPath('.//tr')
+CELL_XPATH = etree.XPath('.//td')
+# The ">" / ">>" links and the numbered pages next to them in the pager
+PAGE_LINK_XPATH = etree.XPath(
+    '//a[contains(text(), ">")]/@href'
+    ' | //a[contains(text(), ">")]/..//a[number(normalize-space(text())) >= 2]/@href'
+)
 
-    lot_url = urljoin(BASE_URL, lot.url)
+# Query parameter of the page number in the pager links, ex. pageIndex=2
+PAGE_PARAMS = {"page", "pageindex", "p"}
 
-    while True:
-        resp = requests.get(lot_url)
-        soup = bs4.BeautifulSoup(resp.text, 'lxml')
-        tree = etree.HTML(str(soup))
+LotPage = namedtuple("LotPage", ["author", "rows", "links"])
 
-        contents = soup.find("table", {"id": "table5"})
+_session = None
+_executor = None
+
+
+def get_session() -> requests.Session:
+    # One keep-alive pool per process, shared by the page threads
+    global _session, _executor
+    if _session is None:
+        _session = requests.Session()
+        _session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=PAGE_THREADS))
+        _executor = ThreadPoolExecutor(max_workers=PAGE_THREADS)
+    return _session
 
-        if contents is None:
-            break
 
-        raw_author = contents.find("h1", {"class": "underline"}).text
-        author = raw_author.replace("Art auction result for", "").strip() if raw_author else None
+def text_of(element) -> str:
+    return "".join(element.itertext())
 
-        lot_table = contents.findAll("table")[1]
-        items = lot_table.findAll("tr")[1:-1]
 
-        instances = []
+def page_key(url: str) -> tuple:
+    """Identify a page of a lot by its url without the page number, and the page number
 
-        for item in items:
-            tds = item.findAll("td")
-            if not tds or len(tds) < 6:
-                continue
+    The same page can be linked under two urls, ex. as "2" and as ">", or as the lot url
+    and as page 1.
 
-            auction_date = tds[1].text.strip()
-            title = tds[2].text.strip()
-            size = tds[3].text.strip()
-            technique = tds[4].text.strip()
-            price = tds[5].text.strip()
+    :return: tuple (normalized url, page number)"""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    numbers = [value for name, value in query if name.lower() in PAGE_PARAMS and value.isdigit()]
+    query = sorted((name, value) for name, value in query if name.lower() not in PAGE_PARAMS)
+    normalized = urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ""))
+    return normalized, int(numbers[0]) if numbers else 1
+
+
+def parse_lot_page(url: str):
+    """Fetch and parse a page of a lot with a single lxml parse
+
+    :return: LotPage or None when the page has no lot table"""
+    tree = etree.HTML(cached_get(url, session=get_session()).content)
+    contents = LOT_TABLE_XPATH(tree) if tree is not None else None
+    if not contents:
+        return None
+    contents = contents[0]
+
+    raw_author = AUTHOR_XPATH(contents)
+    raw_author = text_of(raw_author[0]) if raw_author else None
+    author = raw_author.replace("Art auction result for", "").strip() if raw_author else None
+
+    rows = []
+    tables = TABLE_XPATH(contents)
+    for item in ROW_XPATH(tables[1])[1:-1] if len(tables) > 1 else []:
+        tds = CELL_XPATH(item)
+        if not tds or len(tds) < 6:
+            continue
 
-            instances.append(Item(
-                lot=lot,
+        rows.append((
+            text_of(tds[1]).strip(),
+            text_of(tds[2]).strip(),
+            text_of(tds[3]).strip(),
+            text_of(tds[4]).strip(),
+            text_of(tds[5]).strip(),
+        ))
+
+    links = {urljoin(BASE_URL, href) for href in PAGE_LINK_XPATH(tree)}
+    return LotPage(author, rows, links)
+
+
+def download_lot(lot):
+    if lot.has_lot_downloaded:
+        return
+
+    lot_url = urljoin(BASE_URL, lot.url)
+    get_session()
+
+    # The first page links the next ones, every round fetches the pages found so far at once.
+    # Each page is fetched once, whatever url it is linked under
+    pages = []
+    fetched = {page_key(lot_url)}
+    to_fetch = [lot_url]
+    while to_fetch:
+        for page in _executor.map(parse_lot_page, to_fetch):
+            if page is not None:
+                pages.append(page)
+        if not pages:
+            break
+
+        links = {}
+        for link in set().union(*[page.links for page in pages]):
+            key = page_key(link)
+            if key not in fetched:
+                links.setdefault(key, link)
+        fetched |= links.keys()
+        to_fetch = [links[key] for key in sorted(links)]
+
+    rows = []
+    for page in pages:
+        for auction_date, title, size, technique, price in page.rows:
+            rows.append(dict(
                 auction_date=auction_date,
                 title=title,
                 dimensions=size,
                 technique=technique,
                 start_price=price,
-                author=author,
+                author=page.author,
             ))
 
-        Item.objects.bulk_create(instances)
+    submit(save_lot, lot.pk, rows)
 
-        next_page_button = tree.xpath('//a[contains(text(), ">")]')
-        if next_page_button:
-            lot_url = urljoin(BASE_URL, next_page_button[0].get("href"))
-            continue
 
-        break
+def save_lot(lot_id, rows):
+    """Save the items of a lot and its downloaded flag, runs in the writer process
 
-    lot.has_lot_downloaded = True
-    lot.save()
+    :param lot_id: int
+    :param rows: list of Item field dicts
+    :return: None"""
+    Item.objects.bulk_create([Item(lot_id=lot_id, **row) for row in rows])
+    Lot.objects.filter(pk=lot_id).update(has_lot_downloaded=True)
 
 
 if __name__ == "__main__":
     lots = Lot.objects.filter(hammer_amount__gt=0, has_lot_downloaded=False)
-    log(f"[FINDARTINFO] Stage 2: Total {lots.count()} lots to download")
+    # One count, read from the partial index of the queue
+    total = lots.count()
+    log(f"[FINDARTINFO] Stage 2: Total {total} lots to download")
 
     PROCESSES = 30
 
     # Estimate time in hours to download all lots
     # Running 30 processes, each process takes from 1 to 30 seconds to download 1 lot
-    estimate_min = (lots.count() / PROCESSES) * 30 / 60 / 60
-    estimate_max = (lots.count() / PROCESSES) / 60 / 60
+    estimate_min = (total / PROCESSES) * 30 / 60 / 60
+    estimate_max = (total / PROCESSES) / 60 / 60
 
     log(f"[FINDARTINFO] Stage 2: Estimated time: from {estimate_max:.2f} to {estimate_min:.2f} hours")
 
-    with Pool(PROCESSES) as p:
+    # Workers load their lots by pk range, the lots are never pickled.
+    # Their items go to the writer process, which commits many lots at once
+    with DbWriter() as writer:
         list(tqdm(
-            p.imap_unordered(download_lot, lots),
-            total=lots.count(),
+            map_in_workers(lots, download_lot, PROCESSES, chunk_size=LOTS_PER_TASK),
+            total=total,
             desc=f"[FINDARTINFO] Scraping progress",
             # token=os.getenv("TELEGRAM_TOKEN"),
             # chat_id=os.getenv("TELEGRAM_CHAT_ID"),
             # mininterval=5,
         ))
 
-    log(f"[FINDARTINFO] Stage 2: Done")
+    log(f"[FINDARTINFO] Stage 2: Done, {writer}")
@@ -1,17 +1,11 @@
 import os
-import re
-import uuid
-from multiprocessing import Pool
-from urllib.parse import urljoin
-
-import requests
-import bs4
-import lxml
-import string
+import sys
+
 import dotenv
+import pandas as pd
 
 from django.db import transaction
-from lxml import etree
+from django.utils import timezone
 # from tqdm.contrib.telegram import tqdm
 from tqdm import tqdm
 
@@ -22,30 +16,80 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 import django
 django.setup()
 
-from lots.models import Lot, Item
+from lots.models import Item
+from lots.prettify import RAW_FIELDS, PRETTIFIED_FIELDS, prettify_frame
+from common.dimensions import parse_dimensions
 from core.telegram import log
 
 
-def prettify_item(item):
-    item.prettify()
+CHUNK_SIZE = int(os.getenv("FINDARTINFO_PRETTIFY_CHUNK_SIZE") or 20000)
+
+
+def prettify_chunk(rows):
+    """Prettify one chunk of (pk, *RAW_FIELDS) rows and write it back in a single transaction"""
+    df = pd.DataFrame([row[1:] for row in rows], columns=RAW_FIELDS, index=[row[0] for row in rows])
+    df = prettify_frame(df)
+    # bulk_update skips auto_now, updated_at is stamped here
+    now = timezone.now()
+    items = [
+        Item(pk=pk, updated_at=now, **dict(zip(PRETTIFIED_FIELDS, values))) for pk, *values in df.itertuples(name=None)
+    ]
+    with transaction.atomic():
+        Item.objects.bulk_update(items, PRETTIFIED_FIELDS + ["updated_at"], batch_size=500)
+
+
+def recompute_areas():
+    """Parse the area of every prettified item again, the older rows multiplied the sides by a single 2.54"""
+    items = Item.objects.filter(prettified=True, dimensions__isnull=False)
+    progress = tqdm(total=items.count(), desc="[FINDARTINFO] Recomputing areas")
+    last_pk = 0
+    while True:
+        rows = list(items.filter(pk__gt=last_pk).order_by("pk").values_list("pk", "dimensions")[:CHUNK_SIZE])
+        if not rows:
+            break
+        pks, dimensions = zip(*rows)
+        areas = parse_dimensions(pd.Series(dimensions, dtype=object), default_unit="in")["area_cm2"]
+        now = timezone.now()
+        items_to_update = [
+            Item(pk=pk, area=str(area), updated_at=now) for pk, area in zip(pks, areas) if not pd.isna(area)
+        ]
+        with transaction.atomic():
+            Item.objects.bulk_update(items_to_update, ["area", "updated_at"], batch_size=500)
+        last_pk = rows[-1][0]
+        progress.update(len(rows))
+    progress.close()
 
 
 if __name__ == "__main__":
+    if "--areas" in sys.argv:
+        recompute_areas()
+        log("[FINDARTINFO] Done recomputing areas.")
+        exit()
+
     items = Item.objects.filter(prettified=False)
-    log(f"[FINDARTINFO] Stage 3: Total {items.count()} items to prettify. Estimated time: {items.count() / 200 / 60 / 60:2f} hours.")
+    total = items.count()
+    log(f"[FINDARTINFO] Stage 3: Total {total} items to prettify.")
 
-    if not items.exists():
+    if not total:
         log("[FINDARTINFO] No items to prettify.")
         exit()
 
-    for item in tqdm(
-            items,
-            total=items.count(),
-            desc=f"[FINDARTINFO] Prettifying items",
-            # token=os.getenv("TELEGRAM_TOKEN"),
-            # chat_id=os.getenv("TELEGRAM_CHAT_ID"),
-            # mininterval=1,
-        ):
-        item.prettify()
-
-    log(f"[FINDARTINFO] Done prettifying {items.count()} items.")
+    progress = tqdm(
+        total=total,
+        desc=f"[FINDARTINFO] Prettifying items",
+        # token=os.getenv("TELEGRAM_TOKEN"),
+        # chat_id=os.getenv("TELEGRAM_CHAT_ID"),
+        # mininterval=1,
+    )
+    # Walk by pk, so every chunk is a short indexed query instead of one long cursor
+    last_pk = 0
+    while True:
+        rows = list(items.filter(pk__gt=last_pk).order_by("pk").values_list("pk", *RAW_FIELDS)[:CHUNK_SIZE])
+        if not rows:
+            break
+        prettify_chunk(rows)
+        last_pk = rows[-1][0]
+        progress.update(len(rows))
+    progress.close()
+
+    log(f"[FINDARTINFO] Done prettifying {total} items.")
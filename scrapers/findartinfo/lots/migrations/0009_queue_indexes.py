@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lots', '0008_crawlpage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('prettified', False)), fields=['id'], name='lots_item_to_prettify'),
+        ),
+        migrations.AddIndex(
+            model_name='lot',
+            index=models.Index(condition=models.Q(('hammer_amount__gt', 0), ('has_lot_downloaded', False)), fields=['id'], name='lots_lot_to_download'),
+        ),
+    ]
@@ -1,6 +1,8 @@
-import math
-
 from django.db import models
+from django.db.models import Q
+
+from common.crawl_state import CrawlPageBase
+from common.dimensions import parse_area
 
 
 class Lot(models.Model):
@@ -20,6 +22,14 @@ class Lot(models.Model):
 
     has_lot_downloaded = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Queue of stage 2, walked by pk
+            models.Index(
+                fields=["id"], condition=Q(hammer_amount__gt=0, has_lot_downloaded=False), name="lots_lot_to_download",
+            ),
+        ]
+
 
 class Item(models.Model):
     lot = models.ForeignKey(Lot, on_delete=models.CASCADE)
@@ -36,6 +46,14 @@ class Item(models.Model):
     area = models.CharField(max_length=255, null=True, blank=True)
 
     prettified = models.BooleanField(default=False)
+    # Watermark of the ingestion into data/auctions, see ingest.py
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Queue of stage 3, walked by pk
+            models.Index(fields=["id"], condition=Q(prettified=False), name="lots_item_to_prettify"),
+        ]
 
     def prettify(self):
         if self.prettified:
@@ -55,13 +73,17 @@ class Item(models.Model):
             self.end_price = self.start_price
             self.currency = price[1] if len(price) > 1 else None
 
-        if self.dimensions:
-            # ex. 7.28 x 4.72 in
-            dimensions = self.dimensions.replace(" in", "").split('x')
-            self.area = str(math.prod([float(d) for d in dimensions] + [2.54]))
+        # ex. 7.28 x 4.72 in, every side converted to cm
+        area = parse_area(self.dimensions, default_unit="in")
+        if area is not None:
+            self.area = str(area)
 
         self.prettified = True
         self.save()
 
     def __str__(self):
         return f"{self.title} by {self.author} ({self.auction_date})"
+
+
+class CrawlPage(CrawlPageBase):
+    """Search page of 01_scrape_urls.py, see common.crawl_state"""
@@ -0,0 +1,42 @@
+import pandas as pd
+
+from common.dimensions import parse_dimensions
+
+# Raw columns read by prettify_frame and the columns it writes back
+RAW_FIELDS = ["auction_date", "auction_year", "decade", "start_price", "end_price", "currency", "dimensions", "area"]
+PRETTIFIED_FIELDS = ["auction_year", "decade", "start_price", "end_price", "currency", "area", "prettified"]
+
+
+def _non_empty(column: pd.Series) -> pd.Series:
+    return column.notna() & (column.astype(object).fillna("") != "")
+
+
+def prettify_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Same result as Item.prettify, computed with string ops over whole columns
+
+    :param df: DataFrame with RAW_FIELDS columns
+    :return: DataFrame with PRETTIFIED_FIELDS columns, None for missing values"""
+    df = df.astype(object).copy()
+
+    # ex. 12-Mar-2015
+    has_date = _non_empty(df["auction_date"])
+    year = df["auction_date"].where(has_date, "").str.split("-").str[-1]
+    df["auction_year"] = year.where(has_date, df["auction_year"])
+    df["decade"] = (year.str[:3] + "0").where(has_date, df["decade"])
+
+    # ex. 1,200 USD or Unsold
+    unsold = df["start_price"] == "Unsold"
+    priced = _non_empty(df["start_price"]) & ~unsold
+    price = df["start_price"].where(priced, "").str.split(" ")
+    amount = price.str[0].str.replace(",", "")
+    df["currency"] = price.str[1].where(priced, df["currency"])
+    df["end_price"] = amount.where(priced, df["end_price"]).where(~unsold, "0")
+    df["start_price"] = amount.where(priced, df["start_price"]).where(~unsold, "0")
+
+    # ex. 7.28 x 4.72 in, every side converted to cm
+    area = parse_dimensions(df["dimensions"], default_unit="in")["area_cm2"]
+    df["area"] = area.map(str).where(area.notna(), df["area"])
+
+    df["prettified"] = True
+    df = df[PRETTIFIED_FIELDS].astype(object)
+    return df.where(df.notna(), None)
@@ -1,7 +1,10 @@
 import streamlit as st
 import plotly.express as px
 import pandas as pd
-from StreamlitHelper import Toc, get_img_with_href, read_df, create_table
+from StreamlitHelper import Toc, get_img_with_href, read_df, read_cube, cube_version, create_cube_table, aggregate_cube, cube_overbid_range, map_category_returns
+from build_cube import prepare_auctions
+from data_store import dataset_version
+from scrapers.common.dimensions import to_square_meters
 
 st.set_page_config(
     page_title="Art Index",
@@ -33,13 +36,12 @@ st.markdown(inject_style_css, unsafe_allow_html=True)
 def create_paragraph(text):
     st.markdown('<span style="word-wrap:break-word;">' + text + '</span>', unsafe_allow_html=True)
     
-df = read_df('data/auctions_clean.csv')
-# Fix data
-df = df[df["date"] >= 2001]
-df = df[df["date"] <= 2021]
-df["date"] = df["date"].astype("int")
-df = df.sort_values(by=["date"])
-df.loc[df["technique"]=="Mixed tech", "technique"] = "Mixed technique"
+# Only the columns plotted from raw rows, the rest comes from the cube
+PAGE_COLUMNS = ["date", "year", "decade", "author", "technique", "category", "end_price", "dimension"]
+df = prepare_auctions(read_df('data/auctions_clean.csv', columns=PAGE_COLUMNS))
+# Aggregates of the same rows, built offline with build_cube.py
+cube = read_cube("auctions")
+cube_key = cube_version("auctions")
 df_hist = read_df('data/historical_avg_price.csv')
 df_hist = df_hist[df_hist["date"] >= 2001]
 df_hist = df_hist.groupby("date").sum()
@@ -84,7 +86,7 @@ create_paragraph('''The Art Index gives an overview of the rise and fall in the
 
 # TABLE - categories average price
 toc.subheader('Table - Historical Price Performance by Category')
-table_data = create_table(df, category_column="category", category_list=df["category"].unique(), calculate_volume=False, table_height=150)
+table_data = create_cube_table(cube, category_column="category", category_list=cube["category"].unique(), calculate_volume=False, table_height=150, version=cube_key)
 st.table(table_data)
 create_paragraph('''Ranked by medium, or technique, according to which medium dominates the highest-selling works.''')
 
@@ -104,24 +106,21 @@ For example, in 2001 the auction turnover was around 174,000 euros, then in 2021
 
 # TABLE - categories volume
 toc.subheader('Table - Historical Volume Growth by Category')
-table_data = create_table(df, category_column="category", category_list=df["category"].unique(), calculate_volume=True, table_height=150)
+table_data = create_cube_table(cube, category_column="category", category_list=cube["category"].unique(), calculate_volume=True, table_height=150, version=cube_key)
 st.table(table_data)
 create_paragraph('''From this table, we can see which medium has had the highest turnover. Based on the given data, we can see, for example, that graphics are the most popular and with the highest annual turnover increase percentage (204% annually over 20 years and 35% for oil painting at the same time).''')
 
 # FIGURE - treemap covering categories, techniques and authors by volume and overbid
 toc.subheader('Figure - Art Sales by Category and Artist')
 
-df['start_price'] = df['start_price'].fillna(df['end_price'])
-df['overbid_%'] = (df['end_price'] - df['start_price'])/df['start_price'] * 100
 df['art_work_age'] = df['date'] - df['year']
-df2 = df.groupby(['author', 'technique', 'category']).agg({'end_price':['sum'], 'overbid_%':['mean']})
-df2.columns = ['total_sales', 'overbid_%']
-df2 = df2.reset_index()
+df2 = aggregate_cube(cube, ['author', 'technique', 'category'])
+overbid_mean, overbid_std = cube_overbid_range(cube)
 
 fig = px.treemap(df2, path=[px.Constant("Categories"), 'category', 'technique', 'author'], values='total_sales',
                   color='overbid_%',
                   color_continuous_scale='RdBu',
-                  range_color = (0, df['overbid_%'].mean() + df['overbid_%'].std()),
+                  range_color = (0, overbid_mean + overbid_std),
                   labels={
                      "overbid_%": "Overbid (%)",
                      "total_sales": "Total Sales",
@@ -138,12 +137,9 @@ For example, the blue color shows artists and mediums, which had the highest ove
 # FIGURE - treemap covering categories, techniques and authors by volume and overbid
 toc.subheader('Joonis - Kunsti müügid kategooria ja kunstniku järgi')
 
-table_data = create_table(df, category_column="author", category_list=list(df["author"].unique()), calculate_volume=False, table_height=250)
-df["yearly_performance"] = [table_data[table_data["Kategooria"] == x]["Iga-aastane kasv (%)"] for x in df["author"]]
-df['art_work_age'] = df['date'] - df['year']
-df2 = df.groupby(['author', 'technique', 'category']).agg({'end_price':['sum'], 'yearly_performance':['mean']})
-df2.columns = ['total_sales', 'yearly_performance']
-df2 = df2.reset_index()
+table_data = create_cube_table(cube, category_column="author", category_list=list(cube["author"].unique()), calculate_volume=False, table_height=250, version=cube_key)
+df2 = aggregate_cube(cube, ['author', 'technique', 'category'])
+df2['yearly_performance'] = map_category_returns(df2['author'], table_data)
 
 fig = px.treemap(df2, path=[px.Constant("Categories"), 'category', 'technique', 'author'], values='total_sales',
                   color='yearly_performance',
@@ -161,11 +157,11 @@ create_paragraph('''...
 ''')
 
 # TABLE - best authors average price
-author_sum = df.groupby(["author"], sort=False)["end_price"].sum()
+author_sum = aggregate_cube(cube, ["author"]).set_index("author")["total_sales"]
 top_authors = author_sum.sort_values(ascending=False)[:10]
 
 toc.subheader('Table - Top 10 Best Performing Artists')
-table_data = create_table(df, category_column="author", category_list=top_authors.index, calculate_volume=False, table_height=250)    
+table_data = create_cube_table(cube, category_column="author", category_list=top_authors.index, calculate_volume=False, table_height=250, version=cube_key)
 st.table(table_data)
 create_paragraph('''This table shows the most popular artists and their growth percentage. The percentage is calculated based on annual average end price differences.
 
@@ -174,7 +170,7 @@ Leading this table is Konrad Mägi, whose growth percentage is on average 198.95
 
 # TABLE - best authors volume
 toc.subheader('Table - Volume Growth for Top 10 Artists')
-table_data = create_table(df, category_column="author", category_list=top_authors.index, calculate_volume=True, table_height=250)    
+table_data = create_cube_table(cube, category_column="author", category_list=top_authors.index, calculate_volume=True, table_height=250, version=cube_key)
 st.table(table_data)
 create_paragraph('''This table shows the turnover and average annual growth of art works. Here Wiiralt is positioned at 8th place and Konrad Mägi at 1st. Because the growth percentage is during the whole period (2001-2021) turnover, then the artists, who have the most works bought, are situated at the top of the table.
 ''')
@@ -200,7 +196,7 @@ The oldest work dates back to 1900, but is not the most expensive. In general, i
 
 # FIGURE - size and price
 toc.subheader('Figure - Size of Art Work vs Price')
-df["dimension"] = df["dimension"] / (1000*1000)
+df["dimension"] = to_square_meters(df["dimension"], "mm2")
 fig = px.scatter(df.dropna(subset=["dimension"]), x="dimension", y="end_price", color="category",
                  animation_frame="date", animation_group="technique", hover_name="technique",
                  size='date', hover_data=['author'], size_max=15, range_x=[-0.03,0.35], range_y=[-1000,100000],
@@ -224,10 +220,10 @@ create_credits('''Other credits: Inspired by the original Estonian Art Index cre
 
 toc.generate()
 
-@st.cache
-def convert_df():
+@st.cache_data
+def convert_df(version):
     # IMPORTANT: Cache the conversion to prevent computation on every rerun
     return read_df('data/auctions_clean.csv').to_csv().encode('utf-8')
 
-csv = convert_df()
+csv = convert_df(dataset_version('data/auctions_clean.csv'))
 st.download_button(label="Download data",data=csv, file_name='estonian_art_index.csv', mime='text/csv')
\ No newline at end of file